@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark and fuzzing of the human time parser used by the Time converter.
+
+Adversarial arguments up to discords message length limit get parsed by the previous regex and the current parser,
+the time per character of the current parser has to stay constant. Random arguments are fuzzed to make sure only
+BadArgument gets raised, and well formed durations have to give the same result as the previous regex.
+Run from the repository root using `python -m benchmarks.human_time`.
+"""
+import random
+import re
+import sys
+import time
+
+from mousey import commands
+from mousey.utils.time import _from_human_time
+
+
+MAX_LENGTH = 2000
+FUZZ_ITERATIONS = 20000
+
+# the regex which was used before, for comparison
+TIME_RE = re.compile(
+    r"^(me )?(in )?"
+    r"(?:(?P<months>\d+)( ?months?| ?mo))? ?"
+    r"(?:(?P<weeks>\d+)( ?weeks?| ?w))? ?"
+    r"(?:(?P<days>\d+)( ?days?|d))? ?"
+    r"(?:(?P<hours>\d+)( ?hours?| ?hrs?| ?h))? ?"
+    r"(?:(?P<minutes>\d+)( ?minutes?| ?mins?| ?m))? ?"
+    r"((?P<seconds>\d+)( ?seconds?| ?secs?| ?s))? ?"
+    r"(about |to )?"
+    r"(?P<rest>.*)",
+    re.IGNORECASE
+)
+
+UNIT_SECONDS = (
+    ('months', 60 * 60 * 24 * 30),
+    ('weeks', 60 * 60 * 24 * 7),
+    ('days', 60 * 60 * 24),
+    ('hours', 60 * 60),
+    ('minutes', 60),
+    ('seconds', 1),
+)
+
+# spellings of each unit which the previous regex accepted with and without a space before them
+UNIT_SPELLINGS = (
+    (('months', 'month', 'mo'), ('months', 'month', 'mo')),
+    (('weeks', 'week', 'w'), ('weeks', 'week', 'w')),
+    (('days', 'day'), ('days', 'day', 'd')),
+    (('hours', 'hour', 'hrs', 'hr', 'h'), ('hours', 'hour', 'hrs', 'hr', 'h')),
+    (('minutes', 'minute', 'mins', 'min', 'm'), ('minutes', 'minute', 'mins', 'min', 'm')),
+    (('seconds', 'second', 'secs', 'sec', 's'), ('seconds', 'second', 'secs', 'sec', 's')),
+)
+
+ADVERSARIAL = {
+    'digits': lambda n: '1' * n,
+    'digits then letter': lambda n: '1' * (n - 1) + 'x',
+    'spaced digits': lambda n: '1 ' * (n // 2),
+    'repeated unit': lambda n: '1m' * (n // 2),
+    'spaced units': lambda n: '1 m ' * (n // 4),
+    'repeated in': lambda n: 'in ' * (n // 3),
+    'partial date': lambda n: '2017-' * (n // 5),
+    'partial clock': lambda n: '12:' * (n // 3),
+}
+
+FUZZ_ALPHABET = '0123456789 :-smhdwoyinaboutrec\n'
+
+
+def old_from_human_time(argument: str):
+    match = TIME_RE.search(argument)
+    seconds = sum(int(match.group(name) or 0) * value for name, value in UNIT_SECONDS)
+    return seconds, match.group('rest')
+
+
+def measure(func, argument: str, repeat: int=20) -> float:
+    """Returns the fastest time taken of calling func with the argument in microseconds."""
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            func(argument)
+        except commands.BadArgument:
+            pass
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000 * 1000
+
+
+def benchmark():
+    print(f'{"input":<20} {"length":>6} {"regex":>12} {"parser":>12} {"parser/char":>12}')
+
+    worst = 0
+    for name, make in ADVERSARIAL.items():
+        for length in (100, 500, 1000, MAX_LENGTH):
+            argument = make(length)
+
+            before = measure(old_from_human_time, argument)
+            after = measure(_from_human_time, argument)
+            per_char = after / len(argument) * 1000
+
+            worst = max(worst, after)
+            print(f'{name:<20} {len(argument):>6} {before:>10.2f}us {after:>10.2f}us {per_char:>10.2f}ns')
+
+    print(f'slowest parse: {worst:.2f}us')
+
+
+def well_formed(rng: random.Random) -> str:
+    """Generate a duration both parsers understand, followed by text without numbers."""
+    parts = []
+    if rng.random() < 0.3:
+        parts.append('me')
+    if rng.random() < 0.5:
+        parts.append('in')
+
+    for spaced, attached in UNIT_SPELLINGS:
+        if rng.random() < 0.5:
+            continue
+
+        number = str(rng.randint(0, 99))
+        if rng.random() < 0.5:
+            parts.append(f'{number} {rng.choice(spaced)}')
+        else:
+            parts.append(f'{number}{rng.choice(attached)}')
+
+    if rng.random() < 0.3:
+        parts.append(rng.choice(('about', 'to')))
+
+    parts.extend(rng.choice(('take', 'out', 'the', 'cheese', 'Mousey')) for _ in range(rng.randint(0, 5)))
+    return ' '.join(parts)
+
+
+def fuzz(seed: int):
+    rng = random.Random(seed)
+
+    for _ in range(FUZZ_ITERATIONS):
+        length = rng.randint(0, MAX_LENGTH) if rng.random() < 0.1 else rng.randint(0, 40)
+        argument = ''.join(rng.choice(FUZZ_ALPHABET) for _ in range(length))
+
+        try:
+            seconds, rest = _from_human_time(argument)
+        except commands.BadArgument:
+            continue
+
+        assert 0 <= seconds, argument
+        assert argument.endswith(rest.argument), argument
+
+    for _ in range(FUZZ_ITERATIONS):
+        argument = well_formed(rng)
+
+        seconds, rest = _from_human_time(argument)
+        expected_seconds, expected_rest = old_from_human_time(argument)
+
+        assert seconds == expected_seconds, (argument, seconds, expected_seconds)
+        assert rest.argument == expected_rest, (argument, rest.argument, expected_rest)
+
+    print(f'fuzzed {FUZZ_ITERATIONS * 2} arguments using seed {seed}')
+
+
+if __name__ == '__main__':
+    benchmark()
+    fuzz(int(sys.argv[1]) if len(sys.argv) > 1 else random.randrange(2 ** 32))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Shared parts of the markov benchmarks, the markov module and synthetic chat corpora.
+
+The markov module gets loaded by its file path so discord.py is not needed. It's registered in sys.modules,
+as worker processes look it up by name when unpickling.
+"""
+import importlib.util
+import os
+import random
+import sys
+
+
+spec = importlib.util.spec_from_file_location(
+    'mousey_markov', os.path.join(os.path.dirname(__file__), '..', 'mousey', 'utils', 'markov.py')
+)
+markov = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = markov
+spec.loader.exec_module(markov)
+
+
+def make_messages(rng: random.Random, count: int, vocabulary: int=5000, min_words: int=3, max_words: int=20, *,
+                  rejected: bool=False) -> list:
+    """
+    Messages of words with a zipf like distribution, which is roughly how words in chat are distributed.
+
+    If rejected is True some messages contain multiple lines or punctuation which gets the sentence rejected,
+    like real chat does.
+    """
+    words = [f'word{x}' for x in range(vocabulary)]
+    weights = [1 / (x + 1) for x in range(vocabulary)]
+
+    messages = []
+    for _ in range(count):
+        message = ' '.join(rng.choices(words, weights, k=rng.randint(min_words, max_words)))
+
+        if rejected:
+            roll = rng.random()
+            if roll < 0.05:
+                message += '\n' + ' '.join(rng.choices(words, weights, k=rng.randint(min_words, max_words)))
+            elif roll < 0.07:
+                message = f'"{message}"'
+
+        messages.append(message)
+
+    return messages
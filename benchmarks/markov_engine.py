@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the markov chain engine used by Mousey against markovify.
+
+Synthetic corpora are built into a model of each engine, measuring how long building takes, how much memory the model
+uses according to tracemalloc, and how long generating a sentence takes and how often it fails.
+The markov module gets loaded by benchmarks.markov_corpus so discord.py is not needed,
+markovify needs to be installed to compare.
+Run from the repository root using `python -m benchmarks.markov_engine`.
+"""
+import random
+import time
+import tracemalloc
+
+import markovify
+
+from .markov_corpus import make_messages, markov
+
+
+# (vocabulary size, messages, minimum words, maximum words)
+CORPORA = (
+    (500, 2000, 1, 6),
+    (5000, 10000, 3, 20),
+    (50000, 10000, 3, 20),
+    (5000, 10000, 20, 60),
+)
+SENTENCES = 200
+TRIES = 50
+
+
+def build_markovify(corpus: list):
+    return markovify.NewlineText('\n'.join(corpus))
+
+
+def build_mousey(corpus: list):
+    model = markov.IncrementalText(max_sentences=len(corpus))
+    model.add(corpus)
+    return model
+
+
+def measure(build, corpus: list) -> dict:
+    # tracemalloc slows down allocating a lot, the model is built a second time to measure memory
+    start = time.perf_counter()
+    build(corpus)
+    build_time = time.perf_counter() - start
+
+    tracemalloc.start()
+    model = build(corpus)
+
+    # both engines join the corpus again for overlap checks, this is part of the model
+    model.rejoined_text
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = []
+    failures = 0
+    for _ in range(SENTENCES):
+        start = time.perf_counter()
+        sentence = model.make_sentence(tries=TRIES)
+        latencies.append(time.perf_counter() - start)
+
+        if sentence is None:
+            failures += 1
+
+    latencies.sort()
+    return {
+        'build': build_time * 1000,
+        'memory': memory / (1024 * 1024),
+        'p50': latencies[len(latencies) // 2] * 1000,
+        'p99': latencies[int(len(latencies) * 0.99)] * 1000,
+        'failures': failures / SENTENCES * 100,
+    }
+
+
+def main():
+    rng = random.Random(0)
+
+    print(f'{SENTENCES} sentences of {TRIES} tries each per model')
+    print(
+        f'{"corpus":<24} {"engine":<10} {"build":>10} {"memory":>10} '
+        f'{"sentence p50":>13} {"sentence p99":>13} {"failed":>7}'
+    )
+
+    for vocabulary, messages, min_words, max_words in CORPORA:
+        corpus = make_messages(rng, messages, vocabulary, min_words, max_words)
+        name = f'{messages}x{min_words}-{max_words} of {vocabulary}'
+
+        for engine, build in (('markovify', build_markovify), ('mousey', build_mousey)):
+            random.seed(0)
+            result = measure(build, corpus)
+
+            print(
+                f'{name:<24} {engine:<10} {result["build"]:>8.0f}ms {result["memory"]:>7.1f}MiB '
+                f'{result["p50"]:>11.3f}ms {result["p99"]:>11.3f}ms {result["failures"]:>6.1f}%'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of everything the Markov cog does with models, using synthetic chat corpora.
+
+Each case generates a corpus and builds a model of it in chunks like the cog does, then measures updating it with new
+messages, compacting, storing and loading it, and generating sentences. Every case runs in a fresh process,
+so its peak RSS is not affected by the previous cases. No Discord, PostgreSQL or redis connection is needed.
+
+Results get printed as a table and can be written as JSON, two JSON files can be compared to see what a change did.
+Run from the repository root using `python -m benchmarks.markov_suite [--output results.json]`
+or `python -m benchmarks.markov_suite --compare before.json after.json`.
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from .markov_corpus import make_messages, markov
+
+
+# the same limits the Markov cog uses
+MAX_MESSAGES = 10000
+MESSAGE_CHUNK_SIZE = 1000
+
+# name -> (messages, vocabulary size, minimum words, maximum words)
+CASES = {
+    'small': (1000, 2000, 1, 12),
+    'chat': (10000, 5000, 3, 20),
+    'short messages': (10000, 2000, 1, 4),
+    'long messages': (10000, 5000, 20, 60),
+    'large vocabulary': (10000, 100000, 3, 20),
+    'churn': (40000, 5000, 3, 20),
+}
+UPDATE_MESSAGES = 100
+SENTENCES = 200
+TRIES = 50
+
+# metrics which are printed and compared, lower is better for all of them
+METRICS = (
+    ('build_ms', 'build', 'ms'),
+    ('update_ms', 'update', 'ms'),
+    ('compact_ms', 'compact', 'ms'),
+    ('dump_ms', 'dump', 'ms'),
+    ('load_ms', 'load', 'ms'),
+    ('stored_kib', 'stored', 'KiB'),
+    ('estimated_mib', 'estimated', 'MiB'),
+    ('peak_rss_mib', 'peak rss', 'MiB'),
+    ('sentence_p50_ms', 'p50', 'ms'),
+    ('sentence_p99_ms', 'p99', 'ms'),
+    ('failure_percent', 'failed', '%'),
+)
+
+
+def peak_rss() -> float:
+    # ru_maxrss is in KiB on linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values: list, percent: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def run_case(name: str, seed: int) -> dict:
+    """Run a single case, this is meant to run in a fresh process."""
+    count, vocabulary, min_words, max_words = CASES[name]
+
+    rng = random.Random(seed)
+    messages = make_messages(rng, count, vocabulary, min_words, max_words, rejected=True)
+    update = make_messages(rng, UPDATE_MESSAGES, vocabulary, min_words, max_words, rejected=True)
+
+    baseline_rss = peak_rss()
+    model = markov.IncrementalText(max_sentences=MAX_MESSAGES)
+
+    # the cog adds the corpus in chunks as it's streamed from the database
+    start = time.perf_counter()
+    for index in range(0, len(messages), MESSAGE_CHUNK_SIZE):
+        model.add(messages[index:index + MESSAGE_CHUNK_SIZE], index + MESSAGE_CHUNK_SIZE)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model.add(update, len(messages) + len(update))
+    update_time = time.perf_counter() - start
+
+    compact = None
+    if model.needs_compaction:
+        start = time.perf_counter()
+        model.compact()
+        compact = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data = model.to_bytes()
+    dump = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model = markov.IncrementalText.from_bytes(data)
+    load = time.perf_counter() - start
+
+    random.seed(seed)
+    latencies = []
+    failures = 0
+
+    for _ in range(SENTENCES):
+        start = time.perf_counter()
+        sentence = model.make_sentence(tries=TRIES)
+        latencies.append(time.perf_counter() - start)
+
+        if sentence is None:
+            failures += 1
+
+    latencies.sort()
+
+    return {
+        'case': name,
+        'messages': count,
+        'vocabulary': vocabulary,
+        'words': [min_words, max_words],
+        'sentences': len(model),
+        'build_ms': build * 1000,
+        'update_ms': update_time * 1000,
+        'compact_ms': compact * 1000 if compact is not None else None,
+        'dump_ms': dump * 1000,
+        'load_ms': load * 1000,
+        'stored_kib': len(data) / 1024,
+        'estimated_mib': model.memory_usage / (1024 * 1024),
+        'peak_rss_mib': peak_rss() - baseline_rss,
+        'sentence_p50_ms': percentile(latencies, 50) * 1000,
+        'sentence_p99_ms': percentile(latencies, 99) * 1000,
+        'sentence_max_ms': latencies[-1] * 1000,
+        'failure_percent': failures / SENTENCES * 100,
+    }
+
+
+def format_value(value) -> str:
+    return '-' if value is None else f'{value:.1f}'
+
+
+def print_results(results: list):
+    header = ' '.join(f'{f"{title} ({unit})":>14}' for _, title, unit in METRICS)
+    print(f'{"case":<18} {header}')
+
+    for result in results:
+        values = ' '.join(f'{format_value(result[key]):>14}' for key, _, _ in METRICS)
+        print(f'{result["case"]:<18} {values}')
+
+
+def compare(before_path: str, after_path: str):
+    with open(before_path) as f:
+        before = {x['case']: x for x in json.load(f)['results']}
+    with open(after_path) as f:
+        after = {x['case']: x for x in json.load(f)['results']}
+
+    print(f'change from {before_path} to {after_path}, below 1.00x is an improvement')
+    print(f'{"case":<18} ' + ' '.join(f'{title:>10}' for _, title, _ in METRICS))
+
+    for name in (x for x in before if x in after):
+        ratios = []
+        for key, _, _ in METRICS:
+            old, new = before[name][key], after[name][key]
+            ratios.append(f'{new / old:>9.2f}x' if old and new is not None else f'{"-":>10}')
+
+        print(f'{name:<18} ' + ' '.join(ratios))
+
+
+def git_commit() -> str:
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark markov models using synthetic corpora.')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random corpora and sentences')
+    parser.add_argument('--case', action='append', choices=CASES, help='only run these cases')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two JSON results')
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+
+    names = args.case or list(CASES)
+
+    # a fresh process for every case, otherwise the peak RSS would be the largest of all previous cases
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        results = [pool.apply(run_case, (name, args.seed)) for name in names]
+
+    print_results(results)
+
+    if args.output:
+        data = {
+            'created_at': time.time(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'results': results,
+        }
+
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
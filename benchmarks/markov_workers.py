@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of how much building and using markov models stalls the event loop, using threads and worker processes.
+
+A synthetic corpus gets added to models of a ModelPool while a ticker measures how late the event loop
+wakes it up, which is how late everything else, like gateway heartbeats, would run too.
+The markov module gets loaded by benchmarks.markov_corpus so discord.py is not needed.
+Run from the repository root using `python -m benchmarks.markov_workers`.
+"""
+import asyncio
+import random
+import time
+
+from .markov_corpus import make_messages, markov
+
+
+MODELS = 4
+MESSAGES = 10000
+CHUNK_SIZE = 2500
+SENTENCES = 25
+TICK = 0.001
+
+
+async def ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def run(workers: int, corpora: list) -> dict:
+    loop = asyncio.get_event_loop()
+    pool = markov.ModelPool(loop, workers=workers, max_sentences=MESSAGES)
+
+    # start the worker processes before measuring
+    await asyncio.gather(*(pool.add(f'warmup{x}', ['warm up'], 0) for x in range(max(workers, 1))))
+
+    lags = []
+    stop = asyncio.Event()
+    tick = loop.create_task(ticker(lags, stop))
+
+    start = time.perf_counter()
+
+    async def use(key: str, corpus: list):
+        for index in range(0, len(corpus), CHUNK_SIZE):
+            await pool.add(key, corpus[index:index + CHUNK_SIZE], index + CHUNK_SIZE)
+
+        for _ in range(SENTENCES):
+            await pool.make_sentence(key, tries=50)
+
+    await asyncio.gather(*(use(f'model{x}', corpus) for x, corpus in enumerate(corpora)))
+
+    duration = time.perf_counter() - start
+
+    stop.set()
+    await tick
+    pool.close()
+
+    lags.sort()
+    return {
+        'duration': duration * 1000,
+        'p50': lags[len(lags) // 2] * 1000,
+        'p99': lags[int(len(lags) * 0.99)] * 1000,
+        'max': lags[-1] * 1000,
+    }
+
+
+async def main():
+    rng = random.Random(0)
+    corpora = [make_messages(rng, MESSAGES) for _ in range(MODELS)]
+
+    print(f'{MODELS} models of {MESSAGES} messages, added in chunks of {CHUNK_SIZE}, {SENTENCES} sentences each')
+    print(f'{"mode":<12} {"duration":>10} {"lag p50":>10} {"lag p99":>10} {"lag max":>10}')
+
+    for workers in (0, 1, 2, 4):
+        result = await run(workers, corpora)
+
+        mode = f'{workers} workers' if workers else 'threads'
+        print(
+            f'{mode:<12} {result["duration"]:>8.0f}ms {result["p50"]:>8.2f}ms '
+            f'{result["p99"]:>8.2f}ms {result["max"]:>8.2f}ms'
+        )
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
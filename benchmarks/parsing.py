@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of the argument parser, comparing the parse plans and TokenView to the previous parser.
+
+The commands of mousey/ext/internal/testing.py get parsed with both parsers, no connection to discord is needed.
+Run from the repository root using `python -m benchmarks.parsing`.
+"""
+import asyncio
+import inspect
+import time
+
+import discord
+
+from mousey import commands
+from mousey.commands import RecalledArgument, ViewConverter
+from mousey.commands.core import quoted_word
+from mousey.ext.internal.testing import Testing, TwoWords
+
+
+ITERATIONS = 20000
+
+CASES = (
+    ('error', 'true'),
+    ('type_test', '3'),
+    ('convert multi', 'one two three four five'),
+    ('convert defaults', ''),
+    ('convert defaults', 'one two three'),
+    ('convert optional', '5 some more words'),
+    ('convert optional', 'five some more words'),
+    ('convert optional', 'five ' + 'a long consume rest argument ' * 60),
+)
+
+
+class LegacyTwoWords(commands.Converter, ViewConverter):
+    """TwoWords as it was written for the StringView based parser."""
+
+    async def convert(self, ctx, view):
+        words = []
+        while not view.eof:
+            view.skip_ws()
+            words.append(quoted_word(view))
+
+        return ' '.join(words[:2]), RecalledArgument(' '.join(words[2:]))
+
+
+class LegacyCommand(commands.Command):
+    """Command using the parser from before parse plans and the TokenView were introduced."""
+
+    def _get_converter(self, param):
+        converter = super()._get_converter(param)
+        return LegacyTwoWords if converter is TwoWords else converter
+
+    async def transform(self, ctx, param):
+        required = param.default is param.empty
+        converter = self._get_converter(param)
+        consume_rest_is_special = param.kind == param.KEYWORD_ONLY and not self.rest_is_raw
+
+        view = ctx.view
+        view.skip_ws()
+
+        if view.eof:
+            if param.kind == param.VAR_POSITIONAL:
+                raise RuntimeError()  # break the loop
+            if required:
+                raise commands.MissingRequiredArgument(param)
+            return param.default
+
+        if inspect.isclass(converter) and issubclass(converter, ViewConverter):
+            argument = view
+        elif consume_rest_is_special:
+            argument = view.read_rest().strip()
+        else:
+            argument = quoted_word(view)
+
+        try:
+            result = await self.do_conversion(ctx, converter, argument)
+        except commands.CommandError as e:
+            raise e
+        except Exception as e:
+            try:
+                name = converter.__name__
+            except AttributeError:
+                name = converter.__class__.__name__
+
+            raise commands.BadArgument(f'Converting to "{name}" failed for parameter "{param.name}".') from e
+
+        if not result or isinstance(result, RecalledArgument):
+            if required:
+                raise commands.MissingRequiredArgument(param)
+
+            if isinstance(result, RecalledArgument):
+                view.index -= len(result.argument)
+            result = param.default
+
+        elif isinstance(result, tuple) and isinstance(result[-1], RecalledArgument):
+            *result, recalled = result
+            view.index -= len(recalled.argument)
+
+            if len(result) == 1:
+                result = result[0]
+
+        return result
+
+    async def _parse_arguments(self, ctx):
+        ctx.args = args = [ctx] if self.instance is None else [self.instance, ctx]
+        ctx.kwargs = kwargs = {}
+
+        view = ctx.view
+        iterator = iter(self.params.items())
+
+        if self.instance is not None:
+            try:
+                next(iterator)
+            except StopIteration:
+                raise discord.ClientException(f'Callback for {self.name} command is missing "self" parameter.')
+
+        try:
+            next(iterator)
+        except StopIteration:
+            raise discord.ClientException(f'Callback for {self.name} command is missing "ctx" parameter.')
+
+        for name, param in iterator:
+            if param.kind == param.POSITIONAL_OR_KEYWORD:
+                transformed = await self.transform(ctx, param)
+                args.append(transformed)
+
+            elif param.kind == param.KEYWORD_ONLY:
+                if self.rest_is_raw:
+                    converter = self._get_converter(param)
+                    argument = view.read_rest()
+                    kwargs[name] = await self.do_conversion(ctx, converter, argument)
+                    break
+
+                kwargs[name] = await self.transform(ctx, param)
+
+            elif param.kind == param.VAR_POSITIONAL:
+                while not view.eof:
+                    try:
+                        transformed = await self.transform(ctx, param)
+                        args.append(transformed)
+                    except RuntimeError:
+                        break
+
+        if not self.ignore_extra:
+            if not view.eof:
+                raise commands.TooManyArguments(f'Too many arguments passed to {self.qualified_name}')
+
+
+def get_command(name: str) -> commands.Command:
+    """Get a command of the Testing cog by its qualified name."""
+    parent, *children = name.split()
+
+    command = getattr(Testing, parent)
+    for child in children:
+        command = command.all_commands[child]
+    return command
+
+
+async def parse(command: commands.Command, content: str) -> float:
+    """Parses the content ITERATIONS times and returns the time taken per parse in microseconds."""
+    start = time.perf_counter()
+
+    for _ in range(ITERATIONS):
+        ctx = commands.Context(prefix='!', view=commands.StringView(content), bot=None, message=None)
+        ctx.command = command
+        await command._parse_arguments(ctx)
+
+    return (time.perf_counter() - start) / ITERATIONS * 1000 * 1000
+
+
+async def main():
+    instance = object()  # stands in for the cog, the testing commands don't use it
+
+    print(f'{"command":<18} {"arguments":<26} {"legacy":>10} {"current":>10} {"speedup":>8}')
+
+    for name, content in CASES:
+        command = get_command(name)
+        command.instance = instance
+        command.compile()
+
+        legacy = commands.command(name=command.name, cls=LegacyCommand)(command.callback)
+        legacy.instance = instance
+
+        before = await parse(legacy, content)
+        after = await parse(command, content)
+
+        shown = repr(content if len(content) < 22 else f'{content[:18]}...')
+        print(f'{name:<18} {shown:<26} {before:>8.2f}us {after:>8.2f}us {before / after:>7.2f}x')
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import collections
 import logging
 import time
 from typing import Union
@@ -33,6 +34,8 @@ class Mousey(commands.AutoShardedBot):
     ----------
     guild_count : int
         The amount of guilds the bot is connected to. This only includes guilds on the current shard(s), not all guilds.
+    message_stats : collections.Counter
+        How many messages were processed as possible commands and how many were rejected before building a Context
     process : psutil.Process
         A process instance representing the current process
     session : aiohttp.ClientSession
@@ -60,6 +63,9 @@ class Mousey(commands.AutoShardedBot):
 
         self._uptime: float = None
         self.guild_count: int = None
+        self.message_stats = collections.Counter()
+
+        self._dm_prefixes: commands.PrefixMatcher = None
 
         self.recursively_load_extensions(EXT_PATH)
         log.info(f'loaded {len(self.extensions)} extensions: {", ".join(self.extensions)}')
@@ -95,6 +101,33 @@ class Mousey(commands.AutoShardedBot):
         """Returns the config cog, may be None if not loaded."""
         return self.get_cog('Config')
 
+    @property
+    def mention_prefixes(self):
+        """The prefixes which invoke commands by mentioning Mousey."""
+        return f'<@{self.user.id}> ', f'<@!{self.user.id}> '
+
+    @property
+    def dm_prefixes(self) -> commands.PrefixMatcher:
+        """The prefixes which invoke commands in direct messages, built once the user is known."""
+        if self._dm_prefixes is None:
+            prefixes = [*self.mention_prefixes, ''] if self.prefixless_dms else self.mention_prefixes
+            self._dm_prefixes = commands.PrefixMatcher(prefixes)
+        return self._dm_prefixes
+
+    def find_member(self, guild: discord.Guild, name: str) -> discord.Member:
+        """
+        Look up a member of a guild by their name#discriminator, name or nickname.
+
+        Big guilds are looked up using the member index of the Members cog, which finds members
+        by the same exact names as discord.Guild.get_member_named does in smaller guilds.
+        """
+        members = self.get_cog('Members')
+        index = members.get_index(guild) if members is not None else None
+
+        if index is None:
+            return guild.get_member_named(name)
+        return index.get(name)
+
     async def is_owner(self, user: Union[discord.Member, discord.User]):
         return user.id in BOT_OWNERS  # to allow me using my alt
 
@@ -105,12 +138,41 @@ class Mousey(commands.AutoShardedBot):
         with await self.redis as conn:
             return await conn.sismember('mousey:admins', user.id)
 
+    def could_be_command(self, message: discord.Message) -> bool:
+        """
+        Cheaply checks whether a message could invoke a command, without building a Context.
+
+        Only messages in guilds which have their prefixes loaded already can be rejected, anything else gets processed.
+        """
+        if message.guild is None:
+            return True  # direct messages don't require a prefix
+
+        return self.config.could_be_command(message.guild.id, message.content)
+
     async def process_commands(self, message: discord.Message):
+        if not self.could_be_command(message):
+            self.message_stats['rejected'] += 1
+            return
+
+        self.message_stats['processed'] += 1
+
+        start = time.perf_counter()
         ctx = await self.get_context(message, cls=Context)
         if not ctx.valid:
             return
 
+        timings = ctx.timings
+        timings['context'] = time.perf_counter() - start - timings['prefix']
+
+        start = time.perf_counter()
         await self.invoke(ctx)
+        invoke = time.perf_counter() - start
+
+        # failed commands spend the rest of the time in error handlers instead of the callback
+        if not ctx.command_failed:
+            timings['callback'] = invoke - sum(timings.get(x, 0.0) for x in ('checks', 'arguments', 'send'))
+
+        self.dispatch('command_timings', ctx)
 
     async def on_message(self, message: discord.Message):
         if message.author.bot:
@@ -120,10 +182,7 @@ class Mousey(commands.AutoShardedBot):
 
 
 async def get_prefix(mousey: Mousey, message: discord.Message):
-    mentions = [f'<@{mousey.user.id}> ', f'<@!{mousey.user.id}> ']
-
     if message.guild is None:
-        return mentions
+        return mousey.dm_prefixes
 
-    config = await mousey.config.get(message.guild.id)
-    return mentions + config.get('prefixes', [])
+    return await mousey.config.get_prefixes(message.guild.id)
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from .bot import Bot, BotBase, AutoShardedBot
+from .bot import Bot, BotBase, AutoShardedBot, PrefixMatcher
 from .cog import Cog
 from .context import Context
 from .converter import *
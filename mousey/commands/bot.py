@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*-
 import importlib
+import inspect
+import logging
 import pathlib
+import re
+import time
+from typing import Iterable, Optional
 
 import discord
 from discord.ext import commands
 
 from .context import Context
-from .core import GroupMixin
+from .core import Command, GroupMixin, StringView
 from .formatter import HelpFormatter
 
 
+log = logging.getLogger(__name__)
+
+
 # reassignment to have fewer imports in the actual bot code
 when_mentioned = commands.when_mentioned
 when_mentioned_or = commands.when_mentioned_or
@@ -18,6 +26,48 @@ when_mentioned_or = commands.when_mentioned_or
 DEFAULT_HELP_ATTRS = {'hidden': True}
 
 
+class PrefixMatcher:
+    """
+    Matches the start of a message against a set of prefixes, preferring the longest matching prefix.
+
+    The prefixes get compiled into a single regex alternation once,
+    instead of sorting and scanning a list of prefixes for every message.
+
+    Parameters
+    ----------
+    prefixes : Iterable[str]
+        The prefixes to match against
+
+    Attributes
+    ----------
+    prefixes : Tuple[str]
+        The prefixes, ordered by the length of the prefix
+    """
+
+    def __init__(self, prefixes: Iterable[str]):
+        # the regex engine takes the first alternative which matches, so longer prefixes need to come first
+        self.prefixes = tuple(sorted(set(prefixes), key=lambda x: (-len(x), x)))
+
+        if self.prefixes:
+            self._pattern = re.compile('|'.join(re.escape(x) for x in self.prefixes))
+        else:
+            self._pattern = re.compile('(?!)')  # never matches
+
+    def __iter__(self):
+        return iter(self.prefixes)
+
+    def __contains__(self, prefix: str):
+        return prefix in self.prefixes
+
+    def __repr__(self):
+        return f'<PrefixMatcher prefixes={self.prefixes!r}>'
+
+    def match(self, content: str) -> Optional[str]:
+        """Returns the longest prefix the content starts with, or None if no prefix matches."""
+        match = self._pattern.match(content)
+        return match.group() if match is not None else None
+
+
 class BotBase(GroupMixin, commands.bot.BotBase):
     """
     Extension of the commands.BotBase to provide a few utilities.
@@ -40,6 +90,14 @@ class BotBase(GroupMixin, commands.bot.BotBase):
         self.approve_emoji = kwargs.pop('approve_emoji', None)
         self.prefixless_dms = kwargs.pop('prefixless_dms', False)
 
+    def add_cog(self, cog):
+        super().add_cog(cog)
+
+        # the commands know whether they belong to a cog now, which is needed to compile their parse plans
+        for name, member in inspect.getmembers(cog):
+            if isinstance(member, Command):
+                member.compile()
+
     def remove_cog(self, name: str):
         cog = self.cogs.get(name)
         if cog is None:
@@ -52,6 +110,20 @@ class BotBase(GroupMixin, commands.bot.BotBase):
 
         super().remove_cog(name)
 
+    async def close(self):
+        # cogs may need to finish work, for example writing buffered data, before they get unloaded
+        for cog in tuple(self.cogs.values()):
+            hook = getattr(cog, f'_{cog.__class__.__name__}__close', None)
+            if hook is None:
+                continue
+
+            try:
+                await hook()
+            except Exception:
+                log.exception(f'closing cog {cog.__class__.__name__} failed')
+
+        await super().close()
+
     def reload_extension(self, name: str):
         """Reload an extension."""
         self.unload_extension(name)
@@ -84,19 +156,57 @@ class BotBase(GroupMixin, commands.bot.BotBase):
 
             self.load_extension(name)
 
-    async def get_prefix(self, message: discord.Message):
-        result = await super().get_prefix(message)
+    def find_member(self, guild: discord.Guild, name: str) -> Optional[discord.Member]:
+        """Look up a member of a guild by their name#discriminator, name or nickname. Used by the MemberConverter."""
+        return guild.get_member_named(name)
+
+    async def get_prefix(self, message: discord.Message) -> PrefixMatcher:
+        """
+        Returns the prefixes which can be used to invoke commands with the message as a PrefixMatcher.
+
+        The command_prefix may return a PrefixMatcher itself to avoid building one for every message.
+        """
+        result = self.command_prefix
+        if callable(result):
+            result = result(self, message)
+            if inspect.isawaitable(result):
+                result = await result
 
-        if not isinstance(result, list):
-            if self.prefixless_dms and message.guild is None:
-                return [result, '']
+        if isinstance(result, PrefixMatcher):
             return result
 
+        if isinstance(result, str):
+            result = [result]
+
         if self.prefixless_dms and message.guild is None:
-            result.append('')
+            result = [*result, '']
+
+        return PrefixMatcher(result)
+
+    async def get_context(self, message: discord.Message, *, cls=Context):
+        # this is mostly copied from the superclass, the prefix gets matched using a PrefixMatcher
+        view = StringView(message.content)
+        ctx = cls(prefix=None, view=view, bot=self, message=message)
+
+        if message.author.id == self.user.id:
+            return ctx
+
+        start = time.perf_counter()
+        prefixes = await self.get_prefix(message)
+
+        invoked_prefix = prefixes.match(message.content)
+        ctx.record_timing('prefix', start)
+
+        if invoked_prefix is None:
+            return ctx
+
+        view.skip_string(invoked_prefix)
+        invoker = view.get_word()
 
-        # sort backwards because the parser takes the first match
-        return sorted(result, reverse=True)
+        ctx.invoked_with = invoker
+        ctx.prefix = invoked_prefix
+        ctx.command = self.all_commands.get(invoker)
+        return ctx
 
     async def process_commands(self, message: discord.Message):
         ctx = await self.get_context(message, cls=Context)
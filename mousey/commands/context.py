@@ -1,14 +1,34 @@
 # -*- coding: utf-8 -*-
+import time
+
 import discord
 from discord.ext import commands
 
 
 class Context(commands.Context):
+    def __init__(self, **attrs):
+        super().__init__(**attrs)
+
+        # arguments looked up by converters during this invocation, see resolver.resolve
+        self.resolved = {}
+        # seconds spent in each stage of handling the command, see record_timing.
+        # Mousey.process_commands passes them on with the command_timings event
+        self.timings = {}
+
+    def record_timing(self, stage: str, start: float):
+        """Add the time since start, a time.perf_counter() value, to the time spent in a stage."""
+        self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - start
+
     async def send(self, content: str=None, *, avoid_bots: bool=True, **kwargs):
         if content is not None and avoid_bots:
             # don't add a zws if the message is a codeblock as this adds a newline at the start of the message
             content = f'\N{ZERO WIDTH SPACE}{content}' if not content.startswith('`') else content
-        return await super().send(content, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return await super().send(content, **kwargs)
+        finally:
+            self.record_timing('send', start)
 
     async def ok(self):
         """Adds an approval emoji to the current message or sends it to the current channel."""
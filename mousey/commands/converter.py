@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 import enum
+import inspect
 
 from discord.ext.commands.converter import *
 
 from .context import Context
 from .core import RecalledArgument
 from .errors import BadArgument
+from .resolver import CONVERTERS, MemberConverter, resolve, RoleConverter, TextChannelConverter, UserConverter
 
 
 __all__ = (
@@ -20,6 +22,7 @@ __all__ = (
     'InviteConverter',
     'MemberConverter',
     'Optional',
+    'resolve',
     'RoleConverter',
     'TextChannelConverter',
     'UserConverter',
@@ -35,7 +38,7 @@ class Optional(Converter):
     .. note:: If no default value is set for this parameter MissingRequiredArgument is raised
     """
     def __init__(self, converter):
-        self.converter = converter
+        self.converter = CONVERTERS.get(converter, converter) if inspect.isclass(converter) else converter
 
     async def convert(self, ctx: Context, argument: str):
         try:
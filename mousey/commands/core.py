@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import inspect
+import time
 from typing import Generator
 
 import discord
@@ -8,6 +9,8 @@ from discord.ext.commands.view import quoted_word, StringView
 
 from .context import Context
 from .errors import CommandError, BadArgument, InsufficientPermissions, MissingRequiredArgument, MissingPermissions
+from .resolver import CONVERTERS
+from .view import TokenView
 
 
 __all__ = (
@@ -26,6 +29,7 @@ __all__ = (
     'RecalledArgument',
     'schedule',
     'StringView',
+    'TokenView',
     'user_has_permissions',
     'ViewConverter',
 )
@@ -37,32 +41,92 @@ is_nsfw = commands.is_nsfw
 is_owner = commands.is_owner
 
 
+# returned when a variable amount of arguments reaches the end of the message
+_VAR_POSITIONAL_END = object()
+
+
 class RecalledArgument:
     """
     Converters may return parts of the given argument to be re-used on the next parameter the command has.
 
     This allows for having multi word arguments in the middle of commands: command <multi word> <rest>
     As well as having optional arguments in between required ones: command <argument=default> <required>
+
+    Instead of the text to re-use, ViewConverters can pass the index of the first unconsumed argument of the view.
     """
 
-    def __init__(self, argument: str):
+    def __init__(self, argument: str=None, *, index: int=None):
         self.argument = argument
+        self.index = index
 
 
 class ViewConverter:
     """
-    Converters inheriting from this class do not get the argument passed as a string, but rather the StringView.
+    Converters inheriting from this class do not get the argument passed as a string, but rather the TokenView.
 
     This makes it convenient to write multi word converters, as the words method allows getting one quoted
     word from the view at a time.
     """
 
     @staticmethod
-    def words(view: StringView) -> Generator[str, None, None]:
-        """Yields each argument from a given StringView."""
-        while not view.eof:
-            view.skip_ws()
-            yield quoted_word(view)
+    def words(view: TokenView) -> Generator[str, None, None]:
+        """Yields each argument from a given TokenView."""
+        yield from view.words()
+
+
+class ParseStep:
+    """
+    A precompiled step of parsing the arguments of a command, representing one parameter of the callback.
+
+    Everything which does not depend on the message content (the converter, how the argument is read from the view,
+    the default value) is decided once when the command is compiled, instead of on every invocation.
+    """
+
+    # how the argument gets passed to the callback
+    POSITIONAL = 0
+    KEYWORD = 1
+    RAW_REST = 2
+    VAR_POSITIONAL = 3
+
+    # how the argument gets read from the view
+    WORD = 0
+    REST = 1
+    VIEW = 2
+
+    __slots__ = ('name', 'param', 'kind', 'reader', 'converter', 'converter_name', 'required', 'default')
+
+    def __init__(self, command: 'Command', param: inspect.Parameter):
+        self.name = param.name
+        self.param = param
+
+        converter = command._get_converter(param)
+        try:
+            self.converter_name = converter.__name__
+        except AttributeError:
+            self.converter_name = converter.__class__.__name__
+
+        # discord models get looked up using Mouseys resolver, which parses each argument only once
+        if inspect.isclass(converter):
+            converter = CONVERTERS.get(converter, converter)
+        self.converter = converter
+
+        self.required = param.default is param.empty
+        self.default = param.default
+
+        if param.kind == param.VAR_POSITIONAL:
+            self.kind = self.VAR_POSITIONAL
+        elif param.kind == param.KEYWORD_ONLY:
+            # kwarg only param denotes "consume rest" semantics
+            self.kind = self.RAW_REST if command.rest_is_raw else self.KEYWORD
+        else:
+            self.kind = self.POSITIONAL
+
+        if inspect.isclass(converter) and issubclass(converter, ViewConverter):
+            self.reader = self.VIEW
+        elif self.kind == self.KEYWORD:
+            self.reader = self.REST
+        else:
+            self.reader = self.WORD
 
 
 class Command(commands.Command):
@@ -81,100 +145,138 @@ class Command(commands.Command):
 
         self.typing = typing
 
-    async def transform(self, ctx: Context, param):
-        required = param.default is param.empty
-        converter = self._get_converter(param)
-        consume_rest_is_special = param.kind == param.KEYWORD_ONLY and not self.rest_is_raw
+        self._plan = None
+
+    def compile(self):
+        """
+        Compile the parse plan of the command, which is used to parse arguments on every invocation.
+
+        This gets called when the command is registered with a cog. Commands which have not been compiled
+        get compiled the first time they are invoked.
+        """
+        iterator = iter(self.params.items())
+
+        if self.instance is not None:
+            # we have 'self' as the first parameter so just advance
+            # the iterator and resume parsing
+            try:
+                next(iterator)
+            except StopIteration:
+                raise discord.ClientException(f'Callback for {self.name} command is missing "self" parameter.')
+
+        # next we have the 'ctx' as the next parameter
+        try:
+            next(iterator)
+        except StopIteration:
+            raise discord.ClientException(f'Callback for {self.name} command is missing "ctx" parameter.')
 
-        view = ctx.view
-        view.skip_ws()
+        self._plan = plan = tuple(ParseStep(self, param) for name, param in iterator)
+        return plan
 
+    async def transform(self, ctx: Context, view: TokenView, step: ParseStep):
         if view.eof:
-            if param.kind == param.VAR_POSITIONAL:
-                raise RuntimeError()  # break the loop
-            if required:
-                raise MissingRequiredArgument(param)
-            return param.default
+            if step.kind == step.VAR_POSITIONAL:
+                return _VAR_POSITIONAL_END
+            if step.required:
+                raise MissingRequiredArgument(step.param)
+            return step.default
 
-        if inspect.isclass(converter) and issubclass(converter, ViewConverter):
+        index = view.index
+        offset = view.offset
+
+        if step.reader == step.VIEW:
             argument = view
-        elif consume_rest_is_special:
-            argument = view.read_rest().strip()
+        elif step.reader == step.REST:
+            argument = view.read_rest()
         else:
-            argument = quoted_word(view)
+            argument = view.get_word()
 
         try:
-            result = await self.do_conversion(ctx, converter, argument)
+            result = await self.do_conversion(ctx, step.converter, argument)
         except CommandError as e:
             raise e
         except Exception as e:
-            try:
-                name = converter.__name__
-            except AttributeError:
-                name = converter.__class__.__name__
+            raise BadArgument(f'Converting to "{step.converter_name}" failed for parameter "{step.name}".') from e
 
-            raise BadArgument(f'Converting to "{name}" failed for parameter "{param.name}".') from e
+        recalled = None
 
         if not result or isinstance(result, RecalledArgument):
-            if required:
-                raise MissingRequiredArgument(param)
+            if step.required:
+                raise MissingRequiredArgument(step.param)
 
             if isinstance(result, RecalledArgument):
-                view.index -= len(result.argument)
-            result = param.default
+                recalled = result
+            result = step.default
 
         elif isinstance(result, tuple) and isinstance(result[-1], RecalledArgument):
             *result, recalled = result
-            view.index -= len(recalled.argument)
 
             if len(result) == 1:
                 result = result[0]
 
+        if recalled is not None:
+            self._recall(view, step, recalled, index, offset, argument)
+
         return result
 
+    @staticmethod
+    def _recall(view: TokenView, step: ParseStep, recalled: RecalledArgument, index: int, offset: int, argument):
+        """Move the view back so the next parameter reads the recalled argument."""
+        if recalled.index is not None:
+            view.undo(recalled.index)
+        elif not recalled.argument:
+            return
+        elif step.reader == step.WORD:
+            view.rewind(index, argument, recalled.argument)
+        elif step.reader == step.REST:
+            # the rest is read raw, which means the recalled part maps back onto the buffer exactly
+            view.seek(offset + len(argument) - len(recalled.argument))
+        else:
+            view.seek(max(offset, view.consumed - len(recalled.argument)))
+
+    async def _verify_checks(self, ctx: Context):
+        start = time.perf_counter()
+        try:
+            await super()._verify_checks(ctx)
+        finally:
+            ctx.record_timing('checks', start)
+
     async def _parse_arguments(self, ctx: Context):
+        start = time.perf_counter()
+        try:
+            await self._parse_plan(ctx)
+        finally:
+            ctx.record_timing('arguments', start)
+
+    async def _parse_plan(self, ctx: Context):
         ctx.args = args = [ctx] if self.instance is None else [self.instance, ctx]
         ctx.kwargs = kwargs = {}
 
-        view = ctx.view
-        iterator = iter(self.params.items())
+        # the content gets lexed once while parsing instead of re-reading the StringView for every argument
+        view = TokenView(ctx.view.buffer, ctx.view.index)
+        plan = self._plan if self._plan is not None else self.compile()
 
-        if self.instance is not None:
-            # we have 'self' as the first parameter so just advance
-            # the iterator and resume parsing
-            try:
-                next(iterator)
-            except StopIteration:
-                raise discord.ClientException(f'Callback for {self.name} command is missing "self" parameter.')
+        for step in plan:
+            if step.kind == step.POSITIONAL:
+                args.append(await self.transform(ctx, view, step))
 
-        # next we have the 'ctx' as the next parameter
-        try:
-            next(iterator)
-        except StopIteration:
-            raise discord.ClientException(f'Callback for {self.name} command is missing "ctx" parameter.')
+            elif step.kind == step.KEYWORD:
+                kwargs[step.name] = await self.transform(ctx, view, step)
 
-        for name, param in iterator:
-            if param.kind == param.POSITIONAL_OR_KEYWORD:
-                transformed = await self.transform(ctx, param)
-                args.append(transformed)
+            elif step.kind == step.RAW_REST:
+                argument = view.read_rest(raw=True)
+                kwargs[step.name] = await self.do_conversion(ctx, step.converter, argument)
+                break
 
-            elif param.kind == param.KEYWORD_ONLY:
-                # kwarg only param denotes "consume rest" semantics
-                if self.rest_is_raw:
-                    converter = self._get_converter(param)
-                    argument = view.read_rest()
-                    kwargs[name] = await self.do_conversion(ctx, converter, argument)
-                    break
-
-                kwargs[name] = await self.transform(ctx, param)
-
-            elif param.kind == param.VAR_POSITIONAL:
+            elif step.kind == step.VAR_POSITIONAL:
                 while not view.eof:
-                    try:
-                        transformed = await self.transform(ctx, param)
-                        args.append(transformed)
-                    except RuntimeError:
+                    transformed = await self.transform(ctx, view, step)
+                    if transformed is _VAR_POSITIONAL_END:
                         break
+                    args.append(transformed)
+
+        # keep the StringView in sync, groups continue reading subcommands from it
+        ctx.view.index = view.consumed
 
         if not self.ignore_extra:
             if not view.eof:
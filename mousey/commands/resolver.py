@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import re
+
+import discord
+from discord.ext.commands import converter
+
+from .context import Context
+from .errors import BadArgument
+
+
+__all__ = (
+    'Argument',
+    'MemberConverter',
+    'resolve',
+    'RoleConverter',
+    'TextChannelConverter',
+    'UserConverter',
+)
+
+
+ARGUMENT_RE = re.compile(r'<(?P<type>@!?|@&|#)(?P<mention>[0-9]+)>$|(?P<id>[0-9]{15,21})$')
+
+MENTION_TYPES = {
+    '@': 'user',
+    '@!': 'user',
+    '@&': 'role',
+    '#': 'channel',
+}
+
+
+class Argument:
+    """
+    An argument parsed into what it refers to, so it only needs to be looked up in the matching cache.
+
+    Attributes
+    ----------
+    type : str
+        One of user, role and channel for mentions, id for raw IDs and name for anything else
+    id : Optional[int]
+        The ID of the mention or the raw ID, None for names
+    name : str
+        The argument itself
+    """
+
+    __slots__ = ('type', 'id', 'name')
+
+    def __init__(self, argument: str):
+        self.name = argument
+
+        match = ARGUMENT_RE.match(argument)
+        if match is None:
+            self.type = 'name'
+            self.id = None
+        elif match.group('id') is not None:
+            self.type = 'id'
+            self.id = int(match.group('id'))
+        else:
+            self.type = MENTION_TYPES[match.group('type')]
+            self.id = int(match.group('mention'))
+
+
+def _find_member(ctx: Context, argument: Argument):
+    guild = ctx.guild
+    guilds = [guild] if guild is not None else ctx.bot.guilds
+
+    for guild in guilds:
+        if argument.type == 'name':
+            result = ctx.bot.find_member(guild, argument.name)
+        else:
+            result = guild.get_member(argument.id)
+
+        if result is not None:
+            return result
+
+
+def _find_user(ctx: Context, argument: Argument):
+    if argument.type != 'name':
+        return ctx.bot.get_user(argument.id)
+
+    # like discord.py only name#discriminator and then the username match, nicknames would find the wrong user
+    name = argument.name
+    if len(name) > 5 and name[-5] == '#':
+        name, discriminator = name[:-5], name[-4:]
+        result = discord.utils.find(lambda x: x.name == name and x.discriminator == discriminator, ctx.bot.users)
+        if result is not None:
+            return result
+
+    return discord.utils.find(lambda x: x.name == argument.name, ctx.bot.users)
+
+
+def _find_role(ctx: Context, argument: Argument):
+    if ctx.guild is None:
+        raise BadArgument('Roles can only be used in guilds')
+
+    if argument.type == 'name':
+        return discord.utils.get(ctx.guild.roles, name=argument.name)
+    return ctx.guild.get_role(argument.id)
+
+
+def _find_text_channel(ctx: Context, argument: Argument):
+    if argument.type == 'name':
+        channels = ctx.guild.text_channels if ctx.guild is not None else ctx.bot.get_all_channels()
+        return discord.utils.find(lambda x: isinstance(x, discord.TextChannel) and x.name == argument.name, channels)
+
+    if ctx.guild is not None:
+        result = ctx.guild.get_channel(argument.id)
+    else:
+        result = ctx.bot.get_channel(argument.id)
+
+    return result if isinstance(result, discord.TextChannel) else None
+
+
+# which argument types each kind of object can be found by, anything else does not need to be looked up
+LOOKUPS = {
+    'member': (_find_member, ('user', 'id', 'name')),
+    'user': (_find_user, ('user', 'id', 'name')),
+    'role': (_find_role, ('role', 'id', 'name')),
+    'text_channel': (_find_text_channel, ('channel', 'id', 'name')),
+}
+
+
+def resolve(ctx: Context, argument: str, kind: str):
+    """
+    Look up a discord object from an argument, parsing the argument only once.
+
+    Results are remembered for the current invocation, so converters which get tried again,
+    for example in an Optional or MemberOrChannel, don't look anything up twice.
+
+    Parameters
+    ----------
+    ctx : Context
+        The context of the invocation
+    argument : str
+        The argument to look up
+    kind : str
+        What to look up, one of member, user, role and text_channel
+
+    Returns
+    -------
+    Optional[Union[discord.Member, discord.User, discord.Role, discord.TextChannel]]
+        The object found, or None if nothing matches the argument
+    """
+    memo = ctx.resolved
+
+    try:
+        return memo[kind, argument]
+    except KeyError:
+        pass
+
+    parsed = memo.get((None, argument))
+    if parsed is None:
+        memo[None, argument] = parsed = Argument(argument)
+
+    find, types = LOOKUPS[kind]
+    memo[kind, argument] = result = find(ctx, parsed) if parsed.type in types else None
+
+    return result
+
+
+class MemberConverter(converter.MemberConverter):
+    async def convert(self, ctx: Context, argument: str):
+        result = resolve(ctx, argument, 'member')
+        if result is None:
+            raise BadArgument(f'Member "{argument}" not found')
+        return result
+
+
+class UserConverter(converter.UserConverter):
+    async def convert(self, ctx: Context, argument: str):
+        result = resolve(ctx, argument, 'user')
+        if result is None:
+            raise BadArgument(f'User "{argument}" not found')
+        return result
+
+
+class RoleConverter(converter.RoleConverter):
+    async def convert(self, ctx: Context, argument: str):
+        result = resolve(ctx, argument, 'role')
+        if result is None:
+            raise BadArgument(f'Role "{argument}" not found.')
+        return result
+
+
+class TextChannelConverter(converter.TextChannelConverter):
+    async def convert(self, ctx: Context, argument: str):
+        result = resolve(ctx, argument, 'text_channel')
+        if result is None:
+            raise BadArgument(f'Channel "{argument}" not found.')
+        return result
+
+
+# annotations of discord models use these converters instead of the ones of discord.ext.commands
+CONVERTERS = {
+    discord.Member: MemberConverter,
+    discord.User: UserConverter,
+    discord.Role: RoleConverter,
+    discord.TextChannel: TextChannelConverter,
+}
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import re
+from typing import Generator
+
+from .errors import BadArgument
+
+
+# escaped quotes are allowed everywhere, other backslashes are kept as they are
+_CHAR = r'(?:[^"\\]|\\"|\\(?!"))'
+
+TOKEN_RE = re.compile(
+    r'\s*(?:'
+    rf'"(?P<quoted>{_CHAR}*)"(?=\s|$)'
+    rf'|(?P<word>(?:[^\s"\\]|\\"|\\(?!"))+)(?=\s|$)'
+    rf'|(?P<unclosed>"{_CHAR}*$)'
+    r'|(?P<invalid>\S+)'
+    r')'
+)
+
+WHITESPACE_RE = re.compile(r'\s*')
+
+
+class TokenView:
+    """
+    View over the arguments of a message, which gets lexed into spans of (start, end, quoted) at most once.
+
+    The content is lexed lazily, one argument at a time, so reading the rest of a message never lexes the rest.
+    Spans of quoted arguments exclude the quotes, which means the raw argument is buffer[start - 1:end + 1].
+
+    Parameters
+    ----------
+    buffer : str
+        The content of the message
+    position : int
+        Where the arguments start in the buffer, usually this is after the prefix and command name
+
+    Attributes
+    ----------
+    spans : List[Tuple[int, int, int]]
+        The spans which have been lexed so far
+    index : int
+        The index of the next span to be read
+    start : int
+        The position in the buffer at which the arguments start
+    consumed : int
+        The position in the buffer after the last argument which has been read
+    """
+
+    def __init__(self, buffer: str, position: int=0):
+        self.buffer = buffer
+        self.spans = []
+        self.index = 0
+        self.start = self.consumed = position
+
+        self._position = position  # how far the buffer has been lexed
+        self._errors = {}
+
+    def _lex(self, index: int) -> bool:
+        """Lex the buffer until the span at the specified index exists. Returns whether it exists."""
+        spans = self.spans
+
+        while len(spans) <= index:
+            match = TOKEN_RE.match(self.buffer, self._position)
+            if match is None:
+                return False  # there's nothing but whitespace left
+
+            kind = match.lastgroup
+            start, end = match.span(kind)
+
+            if kind == 'quoted':
+                spans.append((start, end, 1))
+            else:
+                if kind == 'unclosed':
+                    self._errors[len(spans)] = 'Expected closing ".'
+                elif kind == 'invalid':
+                    if match.group(kind).startswith('"'):
+                        self._errors[len(spans)] = 'Expected space after closing quotation'
+                    else:
+                        self._errors[len(spans)] = 'Unexpected quote mark in non-quoted string'
+
+                spans.append((start, end, 0))
+
+            self._position = match.end()
+
+        return True
+
+    @property
+    def eof(self) -> bool:
+        """Whether all arguments have been read."""
+        return not self._lex(self.index)
+
+    @property
+    def offset(self) -> int:
+        """The position in the buffer at which the next argument starts."""
+        if self.index < len(self.spans):
+            start, end, quoted = self.spans[self.index]
+            return start - quoted
+
+        return WHITESPACE_RE.match(self.buffer, self._position).end()
+
+    def text(self, index: int) -> str:
+        """Returns the argument of the span at the specified index, with escaped quotes unescaped."""
+        start, end, quoted = self.spans[index]
+
+        error = self._errors.get(index)
+        if error is not None:
+            raise BadArgument(error)
+
+        text = self.buffer[start:end]
+        if '\\"' in text:
+            text = text.replace('\\"', '"')
+        return text
+
+    def get_word(self) -> str:
+        """Read the next argument. Returns None if all arguments have been read."""
+        if not self._lex(self.index):
+            return None
+
+        start, end, quoted = self.spans[self.index]
+
+        self.index += 1
+        self.consumed = end + quoted
+        return self.text(self.index - 1)
+
+    def read_rest(self, *, raw: bool=False) -> str:
+        """
+        Read the rest of the message, this does not lex the rest of the message.
+
+        Unless raw is True the rest starts at the next argument and trailing whitespace is stripped.
+        """
+        if raw:
+            rest = self.buffer[self.consumed:]
+        else:
+            rest = self.buffer[self.offset:].rstrip()
+
+        self.seek(len(self.buffer))
+        return rest
+
+    def words(self) -> Generator[str, None, None]:
+        """Yields each remaining argument."""
+        while not self.eof:
+            yield self.get_word()
+
+    def seek(self, position: int):
+        """Move the view to a position in the buffer, which needs to be the start of or inside of an argument."""
+        spans = self.spans
+
+        # drop everything which got lexed after the position, it will be lexed again from there
+        index = 0
+        while index < len(spans) and spans[index][1] + spans[index][2] <= position:
+            index += 1
+
+        del spans[index:]
+        for error in [x for x in self._errors if x >= index]:
+            del self._errors[error]
+
+        self.index = index
+        self.consumed = self._position = position
+
+    def undo(self, index: int):
+        """Move the view back to a span which has been read already, it will be read again next."""
+        self.index = index
+
+        if index > 0:
+            start, end, quoted = self.spans[index - 1]
+            self.consumed = end + quoted
+        else:
+            self.consumed = self.start
+
+    def rewind(self, index: int, argument: str, recalled: str):
+        """
+        Rewind the view so a recalled part of a word argument is read again.
+
+        Parameters
+        ----------
+        index : int
+            The index of the span the argument was read from
+        argument : str
+            The argument which was passed to the converter
+        recalled : str
+            The end of the argument which should be read again
+        """
+        start, end, quoted = self.spans[index]
+
+        if recalled == argument:
+            self.seek(start - quoted)
+        elif not quoted:
+            self.seek(end - len(recalled))
+        else:
+            # the recalled part is inside of quotes, it becomes its own argument, without any quotes.
+            # if the argument contained escaped quotes the recalled part only maps back onto the buffer approximately
+            self.seek(end + 1)
+            self.spans[index:] = [(max(start, end - len(recalled)), end, 0)]
+            self.index = index
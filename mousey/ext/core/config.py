@@ -1,49 +1,491 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import functools
 import json
+import logging
+import time
+import uuid
+from typing import Dict
+
+import aioredis
 
 from mousey import Cog, commands, Context, Mousey
+from mousey.utils import LRUCache, Table
+
+
+# at most this many guild configs are kept in memory, the least recently used ones get dropped first
+MAX_CONFIGS = 10000
+# approximate maximum size of all cached configs, measured as their length in JSON
+MAX_CONFIGS_SIZE = 16 * 1024 * 1024
+# seconds after which a config gets loaded from the database again, changes made by Mousey processes get published
+# on INVALIDATION_CHANNEL, so this only matters if the database gets edited by hand, which clear_configs is for
+CONFIG_TTL = None
+
+# whether to load the configs of all guilds of a shard once it's ready, instead of loading each one when it's needed
+PRELOAD_CONFIGS = True
+# how many configs are fetched from the database cursor at once while preloading
+PRELOAD_CHUNK_SIZE = 500
+
+# whether saves are only written to the database every WRITE_BEHIND_INTERVAL seconds, batched into one query.
+# changes still apply to the cached config immediately, they're only missing in the database and other processes
+WRITE_BEHIND = False
+WRITE_BEHIND_INTERVAL = 5
+
+# redis channel on which processes announce guild configs they changed, messages are "<process id>:<guild id>",
+# a guild id of * means every config should be dropped. `PUBLISH mousey:config_invalidations "test:<guild id>"`
+# using redis-cli drops the config of a guild in every running process, tests/test_config.py does this locally.
+INVALIDATION_CHANNEL = 'mousey:config_invalidations'
+# seconds to wait before subscribing again after losing the redis connection
+RESUBSCRIBE_DELAY = 5
+
+
+log = logging.getLogger(__name__)
+
+
+class LoggingConfig:
+    """
+    Which events get logged in a guild.
+
+    Logging configs can't be modified, to change one assign a new one to the guild config using `replace`.
+
+    Attributes
+    ----------
+    messages : bool
+        Whether messages get logged, which is required for markov
+    """
+
+    __slots__ = ('messages', '_extra')
+
+    def __init__(self, data: dict=None):
+        data = dict(data or {})
+
+        object.__setattr__(self, 'messages', bool(data.pop('messages', False)))
+        object.__setattr__(self, '_extra', data)  # keys which aren't used by Mousey yet
+
+    def __setattr__(self, name: str, value):
+        raise AttributeError(f'{self.__class__.__name__} can\'t be modified, use replace to create a new one')
+
+    def replace(self, **kwargs) -> 'LoggingConfig':
+        """Returns a copy of this config with some values replaced."""
+        return LoggingConfig({**self.to_json(), **kwargs})
+
+    def to_json(self) -> dict:
+        return {**self._extra, 'messages': self.messages}
+
+
+class GuildConfig:
+    """
+    The configuration of a guild, which keeps track of which of its keys get changed.
+
+    Any keys in the database which aren't known are kept as they are.
+
+    Attributes
+    ----------
+    prefixes : Tuple[str]
+        The custom prefixes of the guild
+    logging : LoggingConfig
+        Which events get logged in the guild
+    """
+
+    __slots__ = ('__weakref__', 'prefixes', 'logging', '_extra', '_changed')
+
+    # attributes which are stored in the database, as keys of the config
+    FIELDS = ('prefixes', 'logging')
+
+    def __init__(self, data: dict=None):
+        data = dict(data or {})
+
+        object.__setattr__(self, 'prefixes', tuple(data.pop('prefixes', ())))
+        object.__setattr__(self, 'logging', LoggingConfig(data.pop('logging', None)))
+
+        object.__setattr__(self, '_extra', data)
+        object.__setattr__(self, '_changed', set())
+
+    def __setattr__(self, name: str, value):
+        if name == 'prefixes':
+            value = tuple(value)
+
+        super().__setattr__(name, value)
+
+        if name in self.FIELDS:
+            self._changed.add(name)
+
+    def __repr__(self):
+        return f'<GuildConfig prefixes={self.prefixes!r} logging={self.logging.to_json()!r}>'
+
+    @property
+    def modified(self) -> bool:
+        """Whether any keys were changed since the config was last written."""
+        return bool(self._changed)
+
+    def _field_json(self, name: str):
+        value = getattr(self, name)
+        return list(value) if name == 'prefixes' else value.to_json()
+
+    def to_json(self) -> dict:
+        return {**self._extra, **{x: self._field_json(x) for x in self.FIELDS}}
+
+    def take_changes(self) -> dict:
+        """Returns the changed keys and their values, and forgets about them."""
+        changed = {x: self._field_json(x) for x in self._changed}
+        object.__setattr__(self, '_changed', set())
+        return changed
+
+    def restore_changes(self, changed: dict):
+        """Mark changes which failed to be written as changed again."""
+        self._changed.update(changed)
+
+
+def _config_size(config: GuildConfig) -> int:
+    return len(json.dumps(config.to_json()))
 
 
 class Config(Cog):
     def __init__(self, mousey: Mousey):
         super().__init__(mousey)
 
-        self.configs = {}
+        self.configs = LRUCache(
+            max_entries=MAX_CONFIGS, max_size=MAX_CONFIGS_SIZE, ttl=CONFIG_TTL,
+            sizeof=_config_size, on_remove=self._on_config_remove
+        )
+        # compiled prefixes of each guild, these only get rebuilt when the guild config changes
+        self.prefixes = {}
+        # configs which are being loaded from the database, concurrent misses wait for the same task
+        self._loading = {}
+        # configs which have been saved, but which haven't been written to the database yet
+        self._pending = {}
+        # guilds which got invalidated while they had pending writes, they get dropped once they're written
+        self._stale = set()
+
+        # identifies this process in invalidations, so it doesn't drop configs it just saved itself
+        self.process_id = uuid.uuid4().hex
+        self._listener = self.loop.create_task(self._listen())
+
+    def __unload(self):
+        self._listener.cancel()
 
-    async def get(self, guild_id: int) -> dict:
-        """Returns a guilds configuration, either from memory or the database."""
-        if guild_id in self.configs:
-            return self.configs[guild_id]
+        if self._pending:
+            self.loop.create_task(self.flush())
+
+    async def __close(self):
+        await self.flush()
+
+    async def get(self, guild_id: int) -> GuildConfig:
+        """
+        Returns a guilds configuration, either from memory or the database.
+
+        Only one query per guild is made at a time, callers which miss while the config is being loaded
+        wait for the same query. If it fails every one of them gets the exception and nothing is cached,
+        so the next call queries again. Cancelling a caller does not cancel the query for the others.
+        """
+        config = self.configs.get(guild_id)
+
+        if config is None:
+            task = self._loading.get(guild_id)
+
+            if task is None:
+                task = self._loading[guild_id] = self.loop.create_task(self._get(guild_id))
+                task.add_done_callback(functools.partial(self._loaded, guild_id))
+            else:
+                self.configs.stats['coalesced'] += 1
+
+            config = await asyncio.shield(task)
+
+        # a load which got detached by an invalidation may be outdated, its prefixes must not be installed
+        if guild_id not in self.prefixes and self.configs.peek(guild_id) is config:
+            self._update_prefixes(guild_id, config)
 
-        self.configs[guild_id] = config = await self._get(guild_id)
         return config
 
+    async def on_shard_ready(self, shard_id: int):
+        if PRELOAD_CONFIGS:
+            await self.preload(shard_id)
+
+    async def preload(self, shard_id: int):
+        """
+        Load the configs of all guilds of a shard which aren't in memory yet, using a single query.
+
+        Only as many configs as fit into the cache get loaded, the others are still loaded when they're needed.
+        """
+        guild_ids = [
+            x.id for x in self.mousey.guilds
+            if x.shard_id == shard_id and x.id not in self.configs and x.id not in self._loading
+        ]
+        guild_ids = guild_ids[:max(0, self.configs.max_entries - len(self.configs))]
+
+        if not guild_ids:
+            return
+
+        start = time.perf_counter()
+        missing = set(guild_ids)
+
+        async with self.db.acquire() as conn:
+            # cursors can only be used inside of transactions
+            async with conn.transaction():
+                query = 'SELECT guild_id, config FROM guilds WHERE guild_id = ANY($1)'
+                cursor = await conn.cursor(query, guild_ids)
+
+                while True:
+                    records = await cursor.fetch(PRELOAD_CHUNK_SIZE)
+                    if not records:
+                        break
+
+                    for record in records:
+                        guild_id = record['guild_id']
+                        missing.discard(guild_id)
+
+                        self._preloaded(guild_id, GuildConfig(record['config']))
+
+        # guilds which were joined while Mousey was offline don't have a row yet
+        for guild_id in missing:
+            self._preloaded(guild_id, GuildConfig())
+
+        duration = (time.perf_counter() - start) * 1000
+        rows = len(guild_ids) - len(missing)
+
+        self.configs.stats['preloaded'] += len(guild_ids)
+        log.info(f'preloaded {len(guild_ids)} configs ({rows} rows) of shard {shard_id} in {duration:.3f}ms')
+
+    async def preload_available(self):
+        """
+        Preload the configs of every shard which has guilds available, after the configs were dropped.
+
+        This avoids every guild loading its config with its own query, like preloading on shard ready does.
+        """
+        if not PRELOAD_CONFIGS:
+            return
+
+        for shard_id in sorted({x.shard_id for x in self.mousey.guilds}):
+            try:
+                await self.preload(shard_id)
+            except Exception:
+                log.warning(f'preloading configs of shard {shard_id} failed', exc_info=True)
+
+    def _preloaded(self, guild_id: int, config: GuildConfig):
+        # configs which got loaded in the meantime may have been modified already
+        if guild_id in self.configs or guild_id in self._loading:
+            return
+
+        self.configs[guild_id] = config
+        self._update_prefixes(guild_id, config)
+
+    async def get_prefixes(self, guild_id: int) -> commands.PrefixMatcher:
+        """Returns the prefixes which can be used in a guild, including mentioning Mousey."""
+        matcher = self.prefixes.get(guild_id)
+        if matcher is not None and self.configs.touch(guild_id):
+            return matcher
+
+        config = await self.get(guild_id)
+
+        matcher = self.prefixes.get(guild_id)
+        if matcher is None:
+            # the config is outdated already, its prefixes are only used for this message
+            matcher = commands.PrefixMatcher({*self.mousey.mention_prefixes, *config.prefixes})
+        return matcher
+
+    def could_be_command(self, guild_id: int, content: str) -> bool:
+        """
+        Checks whether a message could start with one of the prefixes of a guild, without loading anything.
+
+        If the prefixes of the guild aren't loaded yet this can't be known, so the message is assumed to match.
+        This also keeps the config of the guild from being evicted, and drops it once it expired.
+        """
+        matcher = self.prefixes.get(guild_id)
+        if matcher is None or not self.configs.touch(guild_id):
+            return True
+
+        return matcher.match(content) is not None
+
     async def save(self, guild_id: int):
-        """Save a guild config. This stores it in the database and in memory."""
-        await self._save(guild_id)
+        """
+        Save a guild config. This stores it in the database and in memory.
+
+        Only the keys which changed get written. If WRITE_BEHIND is enabled the config is written by the next flush.
+        """
+        config = self.configs.peek(guild_id)
+
+        self.configs[guild_id] = config  # this also updates the size of the config
+        self._update_prefixes(guild_id, config)
+
+        if not config.modified:
+            return
+
+        if WRITE_BEHIND:
+            # the config can't be evicted before it's written, otherwise a reload could miss the changes
+            if guild_id not in self._pending:
+                self._pending[guild_id] = config
+                self.configs.pin(guild_id)
+            return
+
+        with self.configs.pinned(guild_id):
+            await self._write({guild_id: config})
+
+        await self._publish(guild_id)
+
+    @commands.schedule(WRITE_BEHIND_INTERVAL)
+    async def flush(self):
+        """Write all pending configs to the database."""
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+
+        try:
+            await self._write(pending)
+        except Exception:
+            for guild_id, config in pending.items():
+                if guild_id in self._pending:
+                    self.configs.unpin(guild_id)  # saved again while being written, it's pinned twice
+                else:
+                    self._pending[guild_id] = config
+            raise
 
-    async def _get(self, guild_id: int):
+        for guild_id in pending:
+            self.configs.unpin(guild_id)
+
+            if guild_id in self._stale and guild_id not in self._pending:
+                self._stale.discard(guild_id)
+                self.invalidate(guild_id)
+
+        with await self.redis as conn:
+            for guild_id in pending:
+                await conn.publish(INVALIDATION_CHANNEL, f'{self.process_id}:{guild_id}')
+
+    def invalidate(self, guild_id: int=None):
+        """Drop the config of a guild from memory so it gets loaded again, or every config if no guild ID is given."""
+        # configs which haven't been written yet would lose their changes, they get dropped once they're written
+        if guild_id is None:
+            self._stale.update(self._pending)
+
+            self.configs.clear()
+            self.prefixes = {x: y for x, y in self.prefixes.items() if x in self._pending}
+            self._loading = {}
+        elif guild_id in self._pending:
+            self._stale.add(guild_id)
+        else:
+            self.configs.pop(guild_id)
+            self.prefixes.pop(guild_id, None)
+            self._loading.pop(guild_id, None)
+
+    async def _publish(self, guild_id: int=None):
+        message = f'{self.process_id}:{"*" if guild_id is None else guild_id}'
+
+        with await self.redis as conn:
+            await conn.publish(INVALIDATION_CHANNEL, message)
+
+    async def _listen(self):
+        """Drops configs which other processes changed, for as long as the cog is loaded."""
+        while True:
+            try:
+                with await self.redis as conn:
+                    channel, = await conn.subscribe(INVALIDATION_CHANNEL)
+
+                    # anything could have been changed while not being subscribed
+                    self.invalidate()
+                    self.loop.create_task(self.preload_available())
+
+                    try:
+                        while await channel.wait_message():
+                            self._on_invalidation(await channel.get(encoding='utf-8'))
+                    finally:
+                        await asyncio.shield(conn.unsubscribe(INVALIDATION_CHANNEL))
+            except (aioredis.RedisError, OSError) as e:
+                log.warning(f'lost config invalidation subscription: {type(e).__name__}: {e}')
+
+            await asyncio.sleep(RESUBSCRIBE_DELAY)
+
+    def _on_invalidation(self, message: str):
+        process_id, _, guild_id = message.partition(':')
+        if process_id == self.process_id:
+            return
+
+        if guild_id == '*':
+            self.invalidate()
+        elif guild_id.isdigit():
+            self.invalidate(int(guild_id))
+
+    def _loaded(self, guild_id: int, task: asyncio.Task):
+        if task.cancelled() or task.exception() is not None:
+            config = None  # this also retrieves the exception, in case every caller got cancelled
+        else:
+            config = task.result()
+
+        # if the config got invalidated while it was loading the result may be outdated already
+        if self._loading.get(guild_id) is not task:
+            return
+
+        del self._loading[guild_id]
+        if config is not None:
+            self.configs[guild_id] = config
+            self._update_prefixes(guild_id, config)
+
+    def _update_prefixes(self, guild_id: int, config: GuildConfig):
+        prefixes = {*self.mousey.mention_prefixes, *config.prefixes}
+
+        matcher = self.prefixes.get(guild_id)
+        if matcher is not None and set(matcher.prefixes) == prefixes:
+            return
+
+        self.prefixes[guild_id] = commands.PrefixMatcher(prefixes)
+
+    def _on_config_remove(self, guild_id: int, config: GuildConfig):
+        # messages in guilds without loaded prefixes are treated as possible commands, which loads the config again
+        self.prefixes.pop(guild_id, None)
+
+    async def _get(self, guild_id: int) -> GuildConfig:
         async with self.db.acquire() as conn:
             query = 'SELECT config FROM guilds WHERE guild_id = $1'
             result = await conn.fetchval(query, guild_id)
 
         # if we just joined a guild and load the config the guild row might not exist yet
-        return json.loads(result) if result is not None else {}
+        return GuildConfig(result)
 
-    async def _save(self, guild_id: int):
-        config = json.dumps(self.configs[guild_id])
+    async def _write(self, configs: Dict[int, GuildConfig]):
+        """Write the changed keys of configs to the database, using a single query."""
+        changes = {guild_id: config.take_changes() for guild_id, config in configs.items() if config.modified}
+        if not changes:
+            return
 
-        async with self.db.acquire() as conn:
-            query = 'UPDATE guilds SET config = $1 WHERE guild_id = $2'
-            await conn.execute(query, config, guild_id)
+        try:
+            async with self.db.acquire() as conn:
+                # the jsonb codec of the connection takes care of encoding the changes
+                query = """
+                    UPDATE guilds
+                    SET config = COALESCE(guilds.config, '{}'::jsonb) || patches.changed
+                    FROM unnest($1::bigint[], $2::jsonb[]) AS patches (guild_id, changed)
+                    WHERE guilds.guild_id = patches.guild_id
+                """
+                await conn.execute(query, list(changes), list(changes.values()))
+        except Exception:
+            for guild_id, changed in changes.items():
+                configs[guild_id].restore_changes(changed)
+            raise
 
     @commands.command()
     @commands.is_owner()
     async def clear_configs(self, ctx: Context):
-        """Clears the configs cached in memory."""
-        self.configs = {}
+        """Clears the configs cached in memory, in every Mousey process."""
+        self.invalidate()
+        await self._publish()
         await ctx.ok()
 
+    @commands.command()
+    @commands.is_owner()
+    async def config_stats(self, ctx: Context):
+        """Shows how well the config cache is doing."""
+        stats = self.configs.stats
+
+        table = Table(
+            'entries', 'size', 'hits', 'misses', 'coalesced', 'preloaded', 'evictions', 'expirations', 'revivals'
+        )
+        table.add_row(*map(str, (
+            len(self.configs), self.configs.size, stats['hits'], stats['misses'], stats['coalesced'],
+            stats['preloaded'], stats['evictions'], stats['expirations'], stats['revivals']
+        )))
+
+        rendered = await table.render(self.loop)
+        await ctx.send(f'```\n{rendered}```')
+
 
 def setup(mousey: Mousey):
     mousey.add_cog(Config(mousey))
@@ -24,6 +24,9 @@ class Events(Cog):
         if before.name != after.name:
             self.mousey.dispatch('name_change', after, before.name, after.name)
 
+        if before.discriminator != after.discriminator:
+            self.mousey.dispatch('discriminator_change', after, before.discriminator, after.discriminator)
+
         # not including these as I'm not sure if I'll use them yet~
 
         # status updates ?
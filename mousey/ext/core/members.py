@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import collections
+
+import discord
+
+from mousey import Cog, Mousey
+
+
+# only guilds with at least this many members get indexed, going through all members of smaller guilds is fast enough
+MIN_INDEXED_MEMBERS = 1000
+# at most this many guilds get indexed at the same time, the least recently used index gets dropped first
+MAX_INDEXES = 250
+
+
+def _member_keys(member: discord.Member) -> tuple:
+    """Returns the name#discriminator, name and nickname of a member."""
+    keys = (f'{member.name}#{member.discriminator}', member.name)
+
+    if member.nick is not None:
+        keys += (member.nick,)
+    return keys
+
+
+class MemberIndex:
+    """
+    Index of the name#discriminator, name and nickname of the members of a guild.
+
+    Lookups are dictionary lookups which follow the rules of discord.Guild.get_member_named,
+    so members are found the same way in indexed and in small guilds. The index only stores member IDs
+    and at most three names per member.
+
+    Parameters
+    ----------
+    guild : discord.Guild
+        The guild to index the members of
+    """
+
+    def __init__(self, guild: discord.Guild):
+        self.guild = guild
+
+        self._names = collections.defaultdict(set)  # name -> member IDs
+        self._members = {}  # member ID -> names
+
+        for member in guild.members:
+            keys = self._members[member.id] = _member_keys(member)
+
+            for key in keys:
+                self._names[key].add(member.id)
+
+    def __len__(self):
+        return len(self._members)
+
+    def add(self, member: discord.Member):
+        """Add a member to the index, or update the names of a member."""
+        self.remove(member)
+
+        keys = self._members[member.id] = _member_keys(member)
+
+        for key in keys:
+            self._names[key].add(member.id)
+
+    def remove(self, member: discord.Member):
+        """Remove a member from the index."""
+        keys = self._members.pop(member.id, ())
+
+        for key in keys:
+            ids = self._names[key]
+            ids.discard(member.id)
+
+            if not ids:
+                del self._names[key]
+
+    def get(self, name: str) -> discord.Member:
+        """
+        Look up a member by their name#discriminator, name or nickname.
+
+        If multiple members match, name#discriminator is preferred over the name and then the nickname,
+        like discord.Guild.get_member_named does.
+        """
+        ids = self._names.get(name)
+        if not ids:
+            return None
+
+        members = [x for x in map(self.guild.get_member, ids) if x is not None]
+
+        def rank(member: discord.Member) -> int:
+            if f'{member.name}#{member.discriminator}' == name:
+                return 0
+            if member.name == name:
+                return 1
+            return 2
+
+        return min(members, key=rank, default=None)
+
+
+class Members(Cog):
+    """Keeps member name indexes of big guilds up to date to look up members without going through all members."""
+
+    def __init__(self, mousey: Mousey):
+        super().__init__(mousey)
+
+        self.indexes = collections.OrderedDict()
+
+    def get_index(self, guild: discord.Guild) -> MemberIndex:
+        """Returns the member index of a guild, building it if needed. Returns None if the guild should not be indexed."""
+        index = self.indexes.get(guild.id)
+        if index is not None:
+            self.indexes.move_to_end(guild.id)
+            return index
+
+        # building an index while members are still being received would leave the missing members out of it
+        if guild.member_count < MIN_INDEXED_MEMBERS or not guild.chunked:
+            return None
+
+        self.indexes[guild.id] = index = MemberIndex(guild)
+
+        if len(self.indexes) > MAX_INDEXES:
+            self.indexes.popitem(last=False)
+
+        return index
+
+    def _update(self, member: discord.Member):
+        index = self.indexes.get(member.guild.id)
+        if index is not None:
+            index.add(member)
+
+    async def on_member_join(self, member: discord.Member):
+        self._update(member)
+
+    async def on_member_remove(self, member: discord.Member):
+        index = self.indexes.get(member.guild.id)
+        if index is not None:
+            index.remove(member)
+
+    async def on_nick_update(self, member: discord.Member, before: str, after: str):
+        self._update(member)
+
+    async def on_name_change(self, member: discord.Member, before: str, after: str):
+        self._update(member)
+
+    async def on_discriminator_change(self, member: discord.Member, before: str, after: str):
+        self._update(member)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.indexes.pop(guild.id, None)
+
+    async def on_guild_unavailable(self, guild: discord.Guild):
+        self.indexes.pop(guild.id, None)
+
+
+def setup(mousey: Mousey):
+    mousey.add_cog(Members(mousey))
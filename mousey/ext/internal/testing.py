@@ -19,18 +19,19 @@ class UnhandledTestError(commands.CommandError):
 
 class TwoWords(commands.Converter, commands.ViewConverter):
     """Converter which shows off the usage of ViewConverters and RecalledArguments."""
-    async def convert(self, ctx: Context, view: commands.StringView):
+    async def convert(self, ctx: Context, view: commands.TokenView):
         # the view can be used to iterate over words using the words meth. ViewConverter has
         words = []
         for word in self.words(view):
             words.append(word)
-            # could break out of the loop if a word can not be used
+            if len(words) == 2:
+                break  # could also break out of the loop if a word can not be used
 
         # the first two words are what the converter actually returns
-        ret = ' '.join(words[:2])
-        # the rest can be returned using RecalledArgument, will be used on the next parameter of the command
-        rest = ' '.join(words[2:])
-        return ret, commands.RecalledArgument(rest)
+        ret = ' '.join(words)
+        # the rest is still in the view, RecalledArgument with the index of the first unused argument in the view
+        # makes sure it will be used on the next parameter of the command, even if more words were read
+        return ret, commands.RecalledArgument(index=view.index)
 
 
 class Testing(Cog):
@@ -1,14 +1,54 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import collections
 import functools
+import itertools
+import logging
 import time
+from typing import Dict, List
 
 import discord
-import markovify
 
 from mousey import Cog, commands, Context, Mousey
 from mousey.const import DENY_EMOJI
-from mousey.utils import clean_text, MemberOrChannel
+from mousey.utils import clean_text, LRUCache, MemberOrChannel, ModelInfo, ModelPool
+
+
+# how many of the most recent messages of a target a model is made of
+MAX_MESSAGES = 10000
+# how many worker processes models are kept in, with 0 models are built in threads of the bot process
+MARKOV_WORKERS = 2
+# how many messages are fetched from the database and added to a model at once
+MESSAGE_CHUNK_SIZE = 1000
+# which messages new models are built from, 'recent' for the most recent ones or 'random' for a random sample
+MODEL_SAMPLING = 'recent'
+# percentage of all logged messages which gets sampled when MODEL_SAMPLING is 'random'
+SAMPLE_PERCENT = 10
+# seconds after which unused models get deleted from memory, they're stored in redis before that
+MODEL_TTL = 60 * 10
+# maximum amount of models kept in memory, the least recently used ones get stored in redis and deleted
+MAX_MODELS = 500
+# approximate maximum memory used by all models, as estimated when they're built
+MAX_MODELS_SIZE = 512 * 1024 * 1024
+# seconds during which a model is used as it is, after this messages logged in the meantime get added to it first
+REFRESH_INTERVAL = 60
+# how many models can be built or updated at the same time, more wait in a queue
+MAX_CONCURRENT_BUILDS = 2
+# how many generated sentences are kept ready for each target and channel the markov command was recently used in
+SENTENCE_BUFFER_SIZE = 5
+# how many targets and channels sentences are kept ready for at most, the least recently used ones get dropped
+MAX_SENTENCE_BUFFERS = 200
+# how many sentence buffers can be refilled at the same time
+MAX_CONCURRENT_REFILLS = 1
+# seconds after which the privacy of a channel gets computed again, in case its members' roles changed.
+# changes to channel overwrites and role permissions invalidate it right away
+CHANNEL_PRIVACY_TTL = 60 * 60 * 24 * 7
+# seconds after a model got first built after which it gets built from scratch again,
+# so messages which were deleted from the database don't stay in models forever
+MODEL_STORE_TTL = 60 * 60 * 24 * 7
+
+
+log = logging.getLogger(__name__)
 
 
 class NoMessages(Exception):
@@ -17,18 +57,158 @@ class NoMessages(Exception):
         self.message = message
 
 
+# permission bits used to work out who can read a channel
+ADMINISTRATOR = 1 << 3
+READ_MESSAGES = 1 << 10
+
+
+def _readers(guild, channels) -> Dict[int, int]:
+    """
+    Count how many members of a guild can read each channel.
+
+    Instead of resolving permissions of every member in every channel members get grouped by their roles,
+    each group only gets resolved once per channel. Only the owner and members with their own overwrites in a channel
+    are resolved separately, as discord.py does in TextChannel.permissions_for.
+
+    Returns
+    -------
+    Dict[int, int]
+        The amount of readers of each channel by its ID
+    """
+    role_permissions = {x.id: x.permissions.value for x in guild.roles}
+    everyone = guild.default_role.permissions.value
+
+    groups = collections.Counter(tuple(x._roles) for x in guild.members)
+    group_permissions = {}
+    for role_ids in groups:
+        permissions = everyone
+        for role_id in role_ids:
+            permissions |= role_permissions.get(role_id, 0)
+        group_permissions[role_ids] = permissions
+
+    def can_read(role_ids, overwrites: list, member_id: int=None) -> bool:
+        permissions = group_permissions[role_ids]
+        if permissions & ADMINISTRATOR:
+            return True
+
+        # the @everyone overwrite applies first, then the role overwrites combined and then the member overwrite
+        allow = deny = 0
+        member_overwrite = None
+        for overwrite in overwrites:
+            if overwrite.type == 'member':
+                if overwrite.id == member_id:
+                    member_overwrite = overwrite
+            elif overwrite.id == guild.id:
+                permissions = (permissions & ~overwrite.deny) | overwrite.allow
+            elif overwrite.id in role_ids:
+                allow |= overwrite.allow
+                deny |= overwrite.deny
+
+        permissions = (permissions & ~deny) | allow
+        if member_overwrite is not None:
+            permissions = (permissions & ~member_overwrite.deny) | member_overwrite.allow
+
+        return bool(permissions & READ_MESSAGES)
+
+    readers = {}
+    for channel in channels:
+        overwrites = channel._overwrites
+        count = sum(members for role_ids, members in groups.items() if can_read(role_ids, overwrites))
+
+        # members whose permissions don't only depend on their roles replace the result of their group
+        special = {x.id for x in overwrites if x.type == 'member'}
+        special.add(guild.owner_id)
+
+        for member_id in special:
+            member = guild.get_member(member_id)
+            if member is None:
+                continue
+
+            role_ids = tuple(member._roles)
+            readable = member_id == guild.owner_id or can_read(role_ids, overwrites, member_id)
+            count += readable - can_read(role_ids, overwrites)
+
+        readers[channel.id] = count
+
+    return readers
+
+
+class CachedModel:
+    """
+    What the Markov cog knows about a model in its model pool.
+
+    Attributes
+    ----------
+    info : ModelInfo
+        The info returned by the model pool the last time the model was changed
+    stored_watermark : int
+        The watermark of the model when it was last stored in or loaded from redis
+    last_used : float
+        When the model was last used, in time.monotonic
+    refreshed_at : float
+        When messages were last added to the model, in time.monotonic
+    """
+
+    __slots__ = ('info', 'stored_watermark', 'last_used', 'refreshed_at')
+
+    def __init__(self, info: ModelInfo, stored_watermark: int):
+        self.info = info
+        self.stored_watermark = stored_watermark
+        self.last_used = self.refreshed_at = time.monotonic()
+
+    @property
+    def modified(self) -> bool:
+        """Whether messages were added since the model was last stored."""
+        return self.info.watermark != self.stored_watermark
+
+
+def _model_size(cached: CachedModel) -> int:
+    return cached.info.memory_usage
+
+
 class Markov(Cog):
-    """Markov chains of members and channels."""
+    """
+    Markov chains of members and channels.
+
+    Attributes
+    ----------
+    models : LRUCache
+        The models kept in the model pool, the cache stats count how often a model was already in memory
+    sentences : LRUCache
+        Sentences which are ready to be sent by the markov command, cleaned for the channel they're sent in
+    stats : collections.Counter
+        How many models had to be built or updated (builds), how many callers waited for a build which was already
+        running (coalesced), the total and longest number of seconds builds waited for a free slot
+        (queue_wait, queue_wait_max), and how many sentences were sent from a buffer or generated right away
+        (buffered, unbuffered)
+    """
 
     def __init__(self, mousey: Mousey):
         super().__init__(mousey)
 
-        self.models = {}
-        self.limiter = asyncio.Semaphore()
+        self.pool = ModelPool(self.loop, workers=MARKOV_WORKERS, max_sentences=MAX_MESSAGES)
+        self.models = LRUCache(
+            max_entries=MAX_MODELS, max_size=MAX_MODELS_SIZE, sizeof=_model_size, on_remove=self._on_model_remove
+        )
+        self.stats = collections.Counter()
+
+        self._builds = {}  # target key -> task building or updating the model
+        self._build_slots = asyncio.Semaphore(MAX_CONCURRENT_BUILDS)
+        self._unloading = {}  # target key -> task storing the model and deleting it from the model pool
+
+        # (target key, channel ID) -> deque of sentences
+        self.sentences = LRUCache(max_entries=MAX_SENTENCE_BUFFERS)
+        self._refills = {}  # (target key, channel ID) -> task generating sentences for the buffer
+        self._refill_slots = asyncio.Semaphore(MAX_CONCURRENT_REFILLS)
 
     def __unload(self):
-        for target_key in list(self.models.keys()):
-            del self.models[target_key]
+        for task in itertools.chain(self._builds.values(), self._refills.values()):
+            task.cancel()
+
+        self.loop.create_task(self.close_pool(self.pool, self.models, list(self._unloading.values())))
+
+    async def __close(self):
+        await self.close_pool(self.pool, self.models, list(self._unloading.values()))
 
     @commands.command(typing=True)
     @commands.guild_only()
@@ -45,26 +225,86 @@ class Markov(Cog):
         # check if message logging is even enabled in this guild
         config = await self.mousey.config.get(ctx.guild.id)
 
-        if config.get('logging', {}).get('messages', False) is False:
+        if not config.logging.messages:
             return await ctx.send(f'{DENY_EMOJI} Markov can\'t be used as message logging is not enabled.')
 
-        try:
-            model = await self.get_model(ctx.guild, target)
-        except NoMessages as e:
-            return await ctx.send(e.message)
+        target_key = f'{ctx.guild.id}:{target.id}'
+        buffer = self.sentences.get((target_key, ctx.channel.id))
 
-        make_sentence = functools.partial(model.make_sentence, tries=50)
-        sentence = await self.loop.run_in_executor(None, make_sentence)
+        if buffer:
+            self.stats['buffered'] += 1
+            message = buffer.popleft()
+        else:
+            self.stats['unbuffered'] += 1
 
-        if sentence is not None:
-            message = clean_text(ctx.channel, sentence)
+            # the model can't be evicted to make space for other models while it's being used
+            with self.models.pinned(target_key):
+                try:
+                    await self.get_model(ctx.guild, target)
+                except NoMessages as e:
+                    return await ctx.send(e.message)
+
+                sentence = await self.pool.make_sentence(target_key, tries=50)
+
+            message = clean_text(ctx.channel, sentence) if sentence is not None else None
+
+        # the next use is likely to be soon, so sentences get generated in advance
+        self.refill(ctx.guild, target, ctx.channel)
+
+        if message is not None:
             await ctx.send(message)
         else:
             await ctx.send(f'{DENY_EMOJI} Couldn\'t generate sentence! Target does not have enough messages yet.')
 
+    def refill(self, guild, target, channel):
+        """Start generating sentences for the buffer of a target and channel, unless it's full or being refilled."""
+        buffer_key = (f'{guild.id}:{target.id}', channel.id)
+
+        buffer = self.sentences.peek(buffer_key)
+        if (buffer is not None and len(buffer) >= SENTENCE_BUFFER_SIZE) or buffer_key in self._refills:
+            return
+
+        task = self._refills[buffer_key] = self.loop.create_task(self._refill(guild, target, channel, buffer_key))
+        task.add_done_callback(functools.partial(self._refilled, buffer_key))
+
+    async def _refill(self, guild, target, channel, buffer_key: tuple):
+        target_key, _ = buffer_key
+
+        async with self._refill_slots:
+            with self.models.pinned(target_key):
+                await self.get_model(guild, target)
+
+                buffer = self.sentences.peek(buffer_key)
+                if buffer is None:
+                    buffer = collections.deque(maxlen=SENTENCE_BUFFER_SIZE)
+
+                while len(buffer) < SENTENCE_BUFFER_SIZE:
+                    sentence = await self.pool.make_sentence(target_key, tries=50)
+                    if sentence is None:
+                        break  # the target does not have enough messages, this is handled when it's used again
+
+                    buffer.append(clean_text(channel, sentence))
+
+                # this also makes it the most recently used buffer, it might have been evicted while refilling
+                self.sentences[buffer_key] = buffer
+
+    def _refilled(self, buffer_key: tuple, task: asyncio.Task):
+        if self._refills.get(buffer_key) is task:
+            del self._refills[buffer_key]
+
+        if task.cancelled():
+            return
+
+        e = task.exception()
+        if e is not None and not isinstance(e, NoMessages):
+            log.warning(f'failed to refill markov sentences of {buffer_key}', exc_info=e)
+
     async def get_model(self, guild, target):
         """
-        Generate a markov model of the specified user or channel.
+        Get the markov model of the specified user or channel, creating it if needed.
+
+        Models are kept up to date incrementally, only messages which were logged since the model was last used
+        get fetched and added to it.
 
         Parameters
         ----------
@@ -75,35 +315,152 @@ class Markov(Cog):
 
         Returns
         -------
-        markovify.NewlineText
-            The generated markov model
+        str
+            The key of the model in the model pool
         """
-        async with self.limiter:
-            target_key = f'{guild.id}:{target.id}'
+        target_key = f'{guild.id}:{target.id}'
+
+        # the model is lost if the worker process it was resident in died
+        if target_key in self.models and target_key not in self.pool:
+            self.models.pop(target_key)
+
+        cached = self.models.get(target_key)
+        if cached is not None:
+            cached.last_used = time.monotonic()
 
-            # see if a generated model exists
-            if target_key in self.models:
-                now = time.monotonic()
-                self.models[target_key][0] = now
+            if cached.last_used - cached.refreshed_at < REFRESH_INTERVAL:
+                return target_key
 
-                return self.models[target_key][1]
+        # only one build per target runs at a time, everyone else waits for the running one
+        task = self._builds.get(target_key)
+        if task is None:
+            task = self._builds[target_key] = self.loop.create_task(self._build(guild, target, target_key))
+            task.add_done_callback(functools.partial(self._built, target_key))
+        else:
+            self.stats['coalesced'] += 1
+
+        await asyncio.shield(task)
+        return target_key
+
+    async def _build(self, guild, target, target_key: str):
+        # the model might still be being stored after it got evicted, loading it before that finishes could lose it
+        unloading = self._unloading.get(target_key)
+        if unloading is not None:
+            await asyncio.wait((unloading,))
+
+        queued_at = time.perf_counter()
+
+        async with self._build_slots:
+            waited = time.perf_counter() - queued_at
+
+            self.stats['builds'] += 1
+            self.stats['queue_wait'] += waited
+            self.stats['queue_wait_max'] = max(self.stats['queue_wait_max'], waited)
+
+            cached = self.models.peek(target_key)
+            if cached is not None:
+                info = cached.info
+                stored_watermark = cached.stored_watermark
+            else:
+                info = await self.load_model(target_key)
+                stored_watermark = info.watermark if info is not None else 0
+
+            after = info.watermark if info is not None else 0
+
+            try:
+                async for messages, watermark in self.stream_messages(guild, target, after=after):
+                    info = await self.pool.add(target_key, messages, watermark)
+
+                if info is None:
+                    info = await self.pool.add(target_key, [], after)
+            finally:
+                # chunks which were added before something failed are kept, they don't get fetched again
+                if info is not None:
+                    if cached is None:
+                        cached = CachedModel(info, stored_watermark)
+                    else:
+                        cached.info = info
+                        cached.last_used = cached.refreshed_at = time.monotonic()
+
+                    # this also measures the size of the model again, evicting other models if it grew too much
+                    self.models[target_key] = cached
+
+    def _built(self, target_key: str, task: asyncio.Task):
+        if self._builds.get(target_key) is task:
+            del self._builds[target_key]
+
+        # the exception is retrieved here in case every caller got cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def _on_model_remove(self, target_key: str, cached: CachedModel):
+        task = self._unloading[target_key] = self.loop.create_task(self.unload_model(target_key, cached))
+        task.add_done_callback(functools.partial(self._unloaded, target_key))
+
+    def _unloaded(self, target_key: str, task: asyncio.Task):
+        if self._unloading.get(target_key) is task:
+            del self._unloading[target_key]
+
+        if not task.cancelled() and task.exception() is not None:
+            log.warning(f'failed to unload markov model {target_key}', exc_info=task.exception())
+
+    async def unload_model(self, target_key: str, cached: CachedModel):
+        """Store a model in redis if it changed since it was loaded and delete it from the model pool."""
+        if cached.modified:
+            await self.store_model(target_key, cached.info)
+        await self.pool.drop(target_key)
+
+    async def load_model(self, target_key: str) -> ModelInfo:
+        """Load a model stored in redis into the model pool, returns None if there's no usable stored model."""
+        with await self.redis as conn:
+            data = await conn.get(f'mousey:markov_models:{target_key}')
+
+        if data is None:
+            return None
 
-            messages = await self.get_messages(guild, target)
+        try:
+            info = await self.pool.load(target_key, data)
+        except ValueError as e:
+            log.info(f'discarding stored markov model {target_key}: {e}')
+            return None
+
+        if time.time() - info.created_at > MODEL_STORE_TTL:
+            await self.pool.drop(target_key)
+            return None
+        return info
 
-            def build_model(*msgs: str) -> markovify.NewlineText:
-                return markovify.NewlineText('\n'.join(msgs))
+    async def store_model(self, target_key: str, info: ModelInfo, pool: ModelPool=None):
+        """Store a model in redis, so it does not need to be built again after it's deleted from memory."""
+        pool = pool or self.pool
 
-            make_model = functools.partial(build_model, *messages)
-            model = await self.loop.run_in_executor(None, make_model)
+        data = await pool.dump(target_key)
+        if data is None:
+            return
 
-            now = time.monotonic()
-            self.models[target_key] = [now, model]
+        with await self.redis as conn:
+            expire = max(1, int(info.created_at + MODEL_STORE_TTL - time.time()))
+            await conn.set(f'mousey:markov_models:{target_key}', data, expire=expire)
+
+    async def close_pool(self, pool: ModelPool, models: LRUCache, unloading: list):
+        """Store every model which had messages added to it since it was loaded and shut down the model pool."""
+        try:
+            if unloading:
+                await asyncio.wait(unloading)
 
-            return model
+            for target_key in models:
+                cached = models.peek(target_key)
+                if cached.modified:
+                    await self.store_model(target_key, cached.info, pool)
+        finally:
+            pool.close()
 
-    async def get_messages(self, guild, target):
+    async def stream_messages(self, guild, target, *, after: int=0):
         """
-        Get message content from public guild channels and optionally specific users.
+        Stream message content from public guild channels and optionally specific users.
+
+        Messages are read using a server side cursor, so only one chunk of them is in memory at a time.
+        Models get built from the most recent messages, or with MODEL_SAMPLING set to 'random' from a random sample
+        of messages. Updating a model always uses the messages sent after its watermark.
 
         Parameters
         ----------
@@ -111,78 +468,147 @@ class Markov(Cog):
             The guild to fetch messages from
         target : Union[discord.Member, discord.TextChannel]
             The channel or member to fetch messages from
-
-        Returns
-        -------
-        List[str]
-            The messages the target sent in the specified channels
+        after : int
+            Only messages with a greater ID than this one are fetched
+
+        Yields
+        ------
+        Tuple[List[str], int]
+            Chunks of up to MESSAGE_CHUNK_SIZE messages the target sent in the specified channels, oldest first,
+            and the ID of the most recent message in the chunk
         """
         if isinstance(target, discord.TextChannel):
             channels = [target]
         else:
             channels = guild.text_channels
-        public_channels = []
-
-        for channel in channels:
-            if not await self.channel_is_private(channel):
-                continue
-
-            public_channels.append(channel.id)
+        public_channels = await self.public_channels(guild, channels)
 
         if not public_channels:
             raise NoMessages(f'{DENY_EMOJI} No public target channel could be found. Can\'t generate sentence.')
 
+        if MODEL_SAMPLING == 'random' and not after:
+            # the sample is taken from all messages before filtering, a percentage of blocks is faster than of rows
+            sample = f'TABLESAMPLE SYSTEM ({float(SAMPLE_PERCENT)})'
+        else:
+            sample = ''
+
+        if isinstance(target, discord.Member):
+            condition = 'channel_id = ANY($1) AND message_id > $2 AND author_id = $4'
+            args = (public_channels, after, MAX_MESSAGES, target.id)
+        else:
+            condition = 'channel_id = ANY($1) AND message_id > $2'
+            args = (public_channels, after, MAX_MESSAGES)
+
+        # the most recent messages are picked in the inner query, they're streamed oldest first
+        query = f"""
+            SELECT message_id, content
+            FROM (
+                SELECT message_id, content
+                FROM messages {sample}
+                WHERE {condition}
+                ORDER BY message_id DESC
+                LIMIT $3
+            ) AS recent
+            ORDER BY message_id
+        """
+
         async with self.db.acquire() as conn:
-            if isinstance(target, discord.Member):
-                query = 'SELECT content FROM messages WHERE channel_id=ANY($1) AND author_id = $2 LIMIT 10000'
-                results = await conn.fetch(query, public_channels, target.id)
-            else:
-                query = 'SELECT content FROM messages WHERE channel_id=ANY($1) LIMIT 10000'
-                results = await conn.fetch(query, public_channels)
+            async with conn.transaction():
+                cursor = await conn.cursor(query, *args)
 
-        return [x['content'] for x in results]
+                while True:
+                    results = await cursor.fetch(MESSAGE_CHUNK_SIZE)
+                    if not results:
+                        break
 
-    async def channel_is_private(self, channel):
+                    yield [x['content'] for x in results], results[-1]['message_id']
+
+    async def public_channels(self, guild, channels) -> List[int]:
         """
-        Returns whether a channel has more than 25% of guild population in it.
+        Returns the channels which more than 25% of the guild population can read.
+
+        Results are cached in redis until the overwrites of the channel or the permissions of a role change,
+        all channels are looked up at once and missing ones get computed together using _readers.
 
         Parameters
         ----------
-        channel : discord.TextChannel
-            The channel to calculate user count of
+        guild : discord.Guild
+            The guild the channels are in
+        channels : List[discord.TextChannel]
+            The channels to check
 
         Returns
         -------
-        bool
-            Whether the channel is public or not
+        List[int]
+            The IDs of the public channels
         """
-        key = f'mousey:markov_channels:{channel.id}'
+        if not channels:
+            return []
+
+        keys = [f'mousey:markov_channels:{x.id}' for x in channels]
         with await self.redis as conn:
-            result = await conn.get(key)
+            results = await conn.mget(*keys)
+
+        computed = {}
+
+        missing = [x for x, result in zip(channels, results) if result is None]
+        if missing:
+            readers = _readers(guild, missing)
+            computed = {x.id: readers[x.id] > 0.25 * guild.member_count for x in missing}
+
+            with await self.redis as conn:
+                pipe = conn.pipeline()
+                for channel_id, is_public in computed.items():
+                    pipe.set(f'mousey:markov_channels:{channel_id}', int(is_public), expire=CHANNEL_PRIVACY_TTL)
+                await pipe.execute()
 
-        if result is not None:
-            return bool(int(result))
+        # the pool has no encoding, cached values are b'0' or b'1' and b'0' is truthy
+        results = [computed[x.id] if result is None else result == b'1' for x, result in zip(channels, results)]
+        return [x.id for x, is_public in zip(channels, results) if is_public]
 
-        is_private = len(channel.members) > 0.25 * channel.guild.member_count
+    async def invalidate_channels(self, channels):
+        """Drop the cached privacy of channels, so it gets computed again the next time they're used."""
+        keys = [f'mousey:markov_channels:{x.id}' for x in channels]
+        if not keys:
+            return
 
-        # save result for a day as calculating takes a while on big guilds
         with await self.redis as conn:
-            await conn.set(key, int(is_private), expire=60 * 60 * 24)
+            await conn.delete(*keys)
 
-        return is_private
+    async def on_guild_channel_update(self, before, after):
+        if isinstance(after, discord.TextChannel) and before._overwrites != after._overwrites:
+            await self.invalidate_channels([after])
+
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.permissions != after.permissions:
+            await self.invalidate_channels(after.guild.text_channels)
+
+    async def on_guild_role_delete(self, role: discord.Role):
+        await self.invalidate_channels(role.guild.text_channels)
 
     @commands.schedule(60)
     async def markov_cleaner(self):
-        """Deletes models which haven't been used in the past 10 minutes."""
+        """Deletes models which haven't been used in the past 10 minutes and compacts the others."""
         now = time.monotonic()
 
-        for target_key in list(self.models.keys()):
-            last_used = self.models[target_key][0]
-
-            if now - 60 * 10 < last_used:
+        for target_key in self.models:
+            cached = self.models.peek(target_key)
+            if cached is None or target_key in self._builds:
+                continue  # deleted while a model was being compacted, or being updated right now
+
+            if now - MODEL_TTL < cached.last_used:
+                if cached.info.needs_compaction:
+                    info = await self.pool.compact(target_key)
+                    # messages might have been added while compacting, then the next cleanup compacts it again
+                    if info is not None and info.watermark == cached.info.watermark:
+                        cached.info = info
+                        self.models.resize(target_key)
                 continue
 
-            del self.models[target_key]
+            self.models.pop(target_key)
+
+            self._on_model_remove(target_key, cached)
+            await asyncio.wait((self._unloading[target_key],))
 
 
 def setup(mousey: Mousey):
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import collections
 import datetime
 import inspect
 import logging
@@ -8,20 +10,57 @@ import time
 import discord
 
 from mousey import Cog, commands, Context, Mousey, __version__
-from mousey.const import GUILDS_CHANNEL
-from mousey.utils import clean_text, human_delta, shell
+from mousey.const import DENY_EMOJI, GUILDS_CHANNEL
+from mousey.utils import clean_text, Histogram, human_delta, shell, Table
+
+
+# used commands are written to the database in batches, once this many were used or on the interval
+COMMAND_LOG_BATCH_SIZE = 500
+COMMAND_LOG_INTERVAL = 10
+# how many used commands are kept at most while they can't be written, for example if the database is down.
+# commands used after this are dropped and counted in Stats.stats['dropped_commands']
+MAX_COMMAND_LOG_BUFFER = 50000
+
+# stages of handling a command which are timed, in the order they happen. see Mousey.process_commands
+COMMAND_STAGES = ('prefix', 'context', 'checks', 'arguments', 'callback', 'send')
 
 
 log = logging.getLogger(__name__)
 
 
 class Stats(Cog):
-    """Bot statistics and statistic reporting to various places."""
+    """
+    Bot statistics and statistic reporting to various places.
+
+    Attributes
+    ----------
+    stats : collections.Counter
+        How many used commands were written to the database (logged_commands)
+        and how many were dropped as too many couldn't be written (dropped_commands)
+    command_timings : Dict[str, Dict[str, Histogram]]
+        Qualified command name -> stage -> how long handling the stage took, see COMMAND_STAGES
+    """
 
     def __init__(self, mousey: Mousey):
         super().__init__(mousey)
 
         self.owner: discord.User = None
+        self.stats = collections.Counter()
+        self.command_timings = collections.defaultdict(lambda: collections.defaultdict(Histogram))
+
+        self._command_log = []  # (guild ID, author ID, command name, used at) which haven't been written yet
+        self._flushing = None
+        self._flush_failed = False  # retries are left to the interval instead of every used command
+
+    def __unload(self):
+        if self._command_log:
+            self.loop.create_task(self.flush_command_log())
+
+    async def __close(self):
+        if self._flushing is not None:
+            await asyncio.wait((self._flushing,))
+
+        await self.flush_command_log()
 
     async def on_ready(self):
         await self.post_stats()
@@ -57,11 +96,60 @@ class Stats(Cog):
         # log how many commands are used in which guilds
         guild_id = ctx.guild.id if ctx.guild is not None else ctx.channel.id
 
-        async with self.db.acquire() as conn:
-            query = 'INSERT INTO commands (guild_id, author_id, command, used_at) VALUES ($1, $2, $3, $4)'
-            await conn.execute(
-                query, guild_id, ctx.author.id, ctx.command.qualified_name, datetime.datetime.utcnow()
-            )
+        if len(self._command_log) >= MAX_COMMAND_LOG_BUFFER:
+            self.stats['dropped_commands'] += 1
+            return
+
+        self._command_log.append((guild_id, ctx.author.id, ctx.command.qualified_name, datetime.datetime.utcnow()))
+
+        if len(self._command_log) >= COMMAND_LOG_BATCH_SIZE and not self._flush_failed:
+            self._start_flush()
+
+    async def on_command_timings(self, ctx: commands.Context):
+        histograms = self.command_timings[ctx.command.qualified_name]
+
+        for stage, seconds in ctx.timings.items():
+            histograms[stage].record(seconds)
+
+    def _start_flush(self) -> asyncio.Task:
+        """Start writing the used commands, unless they're being written already. Returns the task writing them."""
+        if self._flushing is None:
+            self._flushing = self.loop.create_task(self._write_command_log())
+            self._flushing.add_done_callback(self._flushed)
+        return self._flushing
+
+    def _flushed(self, task: asyncio.Task):
+        self._flushing = None
+        self._flush_failed = not task.cancelled() and task.exception() is not None
+
+        if self._flush_failed:
+            log.warning('writing used commands failed', exc_info=task.exception())
+
+    @commands.schedule(COMMAND_LOG_INTERVAL)
+    async def flush_command_log(self):
+        """Write the used commands to the database, they're kept to try again later if this fails."""
+        if self._command_log or self._flushing is not None:
+            await asyncio.wait((self._start_flush(),))
+
+    async def _write_command_log(self):
+        if not self._command_log:
+            return
+
+        records, self._command_log = self._command_log, []
+
+        try:
+            async with self.db.acquire() as conn:
+                await conn.copy_records_to_table(
+                    'commands', records=records, columns=('guild_id', 'author_id', 'command', 'used_at')
+                )
+        except Exception:
+            # commands used in the meantime come after these, the oldest ones get dropped if there's too many
+            records.extend(self._command_log)
+            self._command_log = records[-MAX_COMMAND_LOG_BUFFER:]
+            self.stats['dropped_commands'] += len(records) - len(self._command_log)
+            raise
+
+        self.stats['logged_commands'] += len(records)
 
     @commands.command(aliases=['ping'])
     async def rtt(self, ctx: Context):
@@ -135,6 +223,21 @@ class Stats(Cog):
         embed.add_field(name='Cpu Usage', value=f'{cpu_percent}%')
         embed.add_field(name='Memory Usage', value=f"{memory_mib:.3f}MiB")
 
+        message_stats = self.mousey.message_stats
+        messages = message_stats['processed'] + message_stats['rejected']
+        rejected = message_stats['rejected'] / messages * 100 if messages else 0
+
+        embed.add_field(name='Messages', value=f'{messages} seen, {rejected:.1f}% rejected before building a context')
+
+        markov = self.mousey.get_cog('Markov')
+        if markov is not None:
+            models = markov.models
+            lookups = models.stats['hits'] + models.stats['misses']
+            hit_rate = models.stats['hits'] / lookups * 100 if lookups else 0
+            models_mib = models.size / (1024 * 1024)
+
+            embed.add_field(name='Markov Models', value=f'{len(models)} ({models_mib:.1f}MiB), {hit_rate:.1f}% hits')
+
         await ctx.send(embed=embed)
 
     @commands.command(name='commandstats', aliases=['cstats'], disabled=True, hidden=True)
@@ -142,10 +245,44 @@ class Stats(Cog):
         """Shows command usage statistics."""
         pass  # todo
 
-    @commands.command(name='botstats', aliases=['bstats'],  disabled=True, hidden=True)
-    async def mousey_stats(self, ctx: Context):
-        """Shows detailed statistics about Mousey."""
-        pass  # todo
+    @commands.command(name='botstats', aliases=['bstats'], hidden=True)
+    @commands.is_owner()
+    async def mousey_stats(self, ctx: Context, *, command: str=None):
+        """
+        Shows how long each stage of handling commands takes, of all commands or of a single command.
+
+        prefix:    looking up and matching the prefixes
+        context:   building the context, except for the prefix
+        checks:    global and command checks, including blocked users
+        arguments: converting the arguments
+        callback:  running the command, except for sending messages
+        send:      sending messages
+        """
+        if command is None:
+            timings = self.command_timings.values()
+        else:
+            cmd = self.mousey.get_command(command)
+            name = cmd.qualified_name if cmd is not None else command
+
+            if name not in self.command_timings:
+                return await ctx.send(f'{DENY_EMOJI} No timings of `{name}` were recorded yet.')
+            timings = (self.command_timings[name],)
+
+        table = Table('stage', 'count', 'p50', 'p95', 'p99', 'max')
+
+        for stage in COMMAND_STAGES:
+            histogram = Histogram().merge(x[stage] for x in timings if stage in x)
+            if not histogram.count:
+                continue
+
+            durations = (histogram.percentile(50), histogram.percentile(95), histogram.percentile(99), histogram.max)
+            table.add_row(stage, str(histogram.count), *(f'{x * 1000:.2f}ms' for x in durations))
+
+        message_stats = self.mousey.message_stats
+        messages = f'{message_stats["processed"]} messages processed, {message_stats["rejected"]} rejected by prefix'
+
+        rendered = await table.render(self.loop)
+        await ctx.send(f'```\n{rendered}```\n{messages}')
 
     async def post_stats(self):
         if self.mousey.user.id != 288369203046645761:
@@ -63,10 +63,7 @@ class Utility(Cog):
         """Manage and view prefixes."""
         config = await self.mousey.config.get(ctx.guild.id)
 
-        if 'prefixes' not in config:
-            config['prefixes'] = []
-
-        prefixes = config['prefixes'] + [f'<@{self.mousey.user.id}> ']
+        prefixes = [*config.prefixes, f'<@{self.mousey.user.id}> ']
 
         # put prefixes in quotes as they may have trailing spaces
         pretty_prefixes = '\n'.join(f'"{x}"' for x in prefixes)
@@ -79,19 +76,17 @@ class Utility(Cog):
     async def prefix_add(self, ctx: Context, prefix: str):
         """Add a new prefix. To have trailing spaces put it in quotes."""
         config = await self.mousey.config.get(ctx.guild.id)
-
-        if 'prefixes' not in config:
-            config['prefixes'] = []
+        prefixes = config.prefixes
 
         if len(prefix) > 25:
             return await ctx.send(f'{DENY_EMOJI} prefixes may only be 25 characters long!')
 
-        if len(config['prefixes']) > 10:
+        if len(prefixes) > 10:
             return await ctx.send(f'{DENY_EMOJI} you can only add 10 custom prefixes!')
 
         # just give the illusion we added it again, even if it exists
-        if prefix not in config['prefixes']:
-            config['prefixes'].append(prefix)
+        if prefix not in prefixes:
+            config.prefixes = (*prefixes, prefix)
             await self.mousey.config.save(ctx.guild.id)
 
         await ctx.send(f'Added "{prefix}" as a prefix', delete_after=10)
@@ -103,14 +98,12 @@ class Utility(Cog):
     async def prefix_remove(self, ctx: Context, prefix: str):
         """Remove a prefix. To remove a prefix with trailing spaces put it in quotes."""
         config = await self.mousey.config.get(ctx.guild.id)
+        prefixes = config.prefixes
 
-        if 'prefixes' not in config:
-            config['prefixes'] = []
-
-        if prefix not in config['prefixes']:
+        if prefix not in prefixes:
             return await ctx.send(f'{DENY_EMOJI} "{prefix}" is not a valid prefix!')
 
-        config['prefixes'].remove(prefix)
+        config.prefixes = tuple(x for x in prefixes if x != prefix)
         await self.mousey.config.save(ctx.guild.id)
 
         await ctx.send(f'Removed "{prefix}" from prefixes.', delete_after=10)
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
+from .cache import LRUCache
 from .checks import is_admin
 from .converters import *
+from .db import init_connection
 from .formatting import clean_formatting, clean_mentions, clean_text, name_id, Table
+from .histogram import Histogram
+from .markov import IncrementalText, ModelInfo, ModelPool
 from .misc import shell
 from .time import human_delta, Time, Timer
 from .web import get_json, haste
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import collections
+import contextlib
+import sys
+import time
+import weakref
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """
+    Least recently used cache with a maximum amount of entries, an approximate size budget and an optional TTL.
+
+    Entries which get evicted or expire are remembered weakly, as long as something else still holds on to them
+    they are returned again instead of being loaded a second time. This means modifying a cached object can't be
+    lost by it getting evicted in the meantime, as whoever modifies it keeps it alive.
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum amount of entries to keep
+    max_size : Optional[int]
+        The approximate maximum size of all entries, as measured by sizeof
+    ttl : Optional[float]
+        Seconds after which an entry is considered outdated, an outdated entry gets treated as missing
+    sizeof : Callable[[Any], int]
+        Used to measure the size of an entry, only used if max_size is set
+    on_remove : Optional[Callable[[Hashable, Any], None]]
+        Called with the key and value of entries which get evicted or expire
+
+    Attributes
+    ----------
+    size : int
+        The approximate size of all entries
+    stats : collections.Counter
+        How many hits, misses, evictions, expirations and revivals of evicted entries happened
+    """
+
+    def __init__(self, *, max_entries: int, max_size: int=None, ttl: float=None,
+                 sizeof: Callable[[Any], int]=sys.getsizeof, on_remove: Callable[[Hashable, Any], None]=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.size = 0
+        self.stats = collections.Counter()
+
+        self._sizeof = sizeof
+        self._on_remove = on_remove
+
+        self._entries = collections.OrderedDict()  # key -> [value, size, expires at]
+        self._retired = weakref.WeakValueDictionary()
+        self._pins = collections.Counter()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        return key in self._entries
+
+    def __iter__(self):
+        # a copy, so entries can be removed while iterating
+        return iter(list(self._entries))
+
+    def __getitem__(self, key: Hashable):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.set(key, value)
+
+    def get(self, key: Hashable, default: Any=None) -> Any:
+        """Returns the value of a key and marks it as recently used, or the default if the key is not cached."""
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            if entry[2] is None or entry[2] > time.monotonic() or key in self._pins:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[0]
+
+            self.stats['expirations'] += 1
+            self._remove(key)
+
+        value = self._retired.pop(key, None)
+        if value is not None:
+            self.stats['revivals'] += 1
+            self.set(key, value)
+            return value
+
+        self.stats['misses'] += 1
+        return default
+
+    def touch(self, key: Hashable) -> bool:
+        """
+        Mark an entry as recently used without returning it or counting a hit.
+
+        For keeping entries alive which are used through something derived from them.
+        Returns False if the key is not cached or its entry expired, which removes it.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+
+        if entry[2] is None or entry[2] > time.monotonic() or key in self._pins:
+            self._entries.move_to_end(key)
+            return True
+
+        self.stats['expirations'] += 1
+        self._remove(key)
+        return False
+
+    def peek(self, key: Hashable, default: Any=None) -> Any:
+        """Returns the value of a key regardless of it being outdated, without marking it as recently used."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry[0]
+
+        return self._retired.get(key, default)
+
+    def set(self, key: Hashable, value: Any):
+        """Add or replace an entry, this also refreshes its size and TTL."""
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+
+        size = self._sizeof(value) if self.max_size is not None else 0
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+
+        self._entries[key] = [value, size, expires_at]
+        self.size += size
+
+        self._evict()
+
+    def resize(self, key: Hashable):
+        """Measure the size of an entry again after it changed, without marking it as recently used."""
+        entry = self._entries.get(key)
+        if entry is None or self.max_size is None:
+            return
+
+        size = self._sizeof(entry[0])
+        self.size += size - entry[1]
+        entry[1] = size
+
+        self._evict()
+
+    def pop(self, key: Hashable, default: Any=None) -> Any:
+        """Remove an entry, it won't be returned again even if it's still referenced somewhere else."""
+        self._retired.pop(key, None)
+
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+
+        self.size -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        """Remove all entries which aren't pinned."""
+        for key in [x for x in self._entries if x not in self._pins]:
+            self.pop(key)
+
+        self._retired.clear()
+
+    def pin(self, key: Hashable):
+        """Prevent an entry from being evicted or expiring until it gets unpinned as often as it got pinned."""
+        self._pins[key] += 1
+
+    def unpin(self, key: Hashable):
+        self._pins[key] -= 1
+        if self._pins[key] <= 0:
+            del self._pins[key]
+
+        self._evict()
+
+    @contextlib.contextmanager
+    def pinned(self, key: Hashable):
+        """Context manager which keeps an entry pinned while it's entered."""
+        self.pin(key)
+        try:
+            yield
+        finally:
+            self.unpin(key)
+
+    def _remove(self, key: Hashable):
+        value, size, expires_at = self._entries.pop(key)
+        self.size -= size
+
+        try:
+            self._retired[key] = value
+        except TypeError:
+            pass  # the value can't be weakly referenced
+
+        if self._on_remove is not None:
+            self._on_remove(key, value)
+
+    def _full(self) -> bool:
+        return len(self._entries) > self.max_entries or (self.max_size is not None and self.size > self.max_size)
+
+    def _evict(self):
+        # pinned entries are skipped, if every entry is pinned the cache stays above its limits until they're unpinned
+        while self._full():
+            for key in self._entries:
+                if key not in self._pins:
+                    break
+            else:
+                return
+
+            self.stats['evictions'] += 1
+            self._remove(key)
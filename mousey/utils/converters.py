@@ -11,14 +11,9 @@ class MemberOrChannel(commands.Converter):
     """Converter which attempts to convert to a member or channel."""
 
     async def convert(self, ctx: Context, argument: str):
-        try:
-            return await commands.MemberConverter().convert(ctx, argument)
-        except commands.BadArgument:
-            pass
+        # mentions only get looked up as what they mention, IDs and names as a member first
+        result = commands.resolve(ctx, argument, 'member') or commands.resolve(ctx, argument, 'text_channel')
 
-        try:
-            return await commands.TextChannelConverter().convert(ctx, argument)
-        except commands.BadArgument:
-            pass
-
-        raise commands.BadArgument(f'Member or Channel "{argument}" not found.')
+        if result is None:
+            raise commands.BadArgument(f'Member or Channel "{argument}" not found.')
+        return result
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+import json
+
+import asyncpg
+
+
+async def init_connection(conn: asyncpg.connection.Connection):
+    """
+    Sets up a new database connection, this should be passed as init when creating the pool.
+
+    JSON and JSONB values get decoded into python objects by the connection, and python objects get encoded to JSON.
+    """
+    for type_ in ('json', 'jsonb'):
+        await conn.set_type_codec(type_, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import bisect
+from typing import Iterable
+
+
+# upper bounds of the buckets in seconds, growing by 25% from 50 microseconds up to about two minutes.
+# values are only known to the precision of their bucket, which is good enough for latencies and cheap to record
+BUCKETS = tuple(0.00005 * 1.25 ** x for x in range(67))
+
+
+class Histogram:
+    """
+    Histogram of durations in fixed, exponentially growing buckets.
+
+    Recording a duration is a bisect and an increment, percentiles are the upper bound of the bucket they fall into.
+
+    Attributes
+    ----------
+    counts : List[int]
+        How many durations fell into each bucket, the last one counts durations which are longer than all buckets
+    count : int
+        How many durations were recorded
+    total : float
+        The sum of all recorded durations in seconds
+    max : float
+        The longest recorded duration in seconds
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, others: Iterable['Histogram']) -> 'Histogram':
+        """Add the durations of other histograms to this one, returns itself."""
+        for other in others:
+            self.counts = [x + y for x, y in zip(self.counts, other.counts)]
+            self.count += other.count
+            self.total += other.total
+            self.max = max(self.max, other.max)
+
+        return self
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent: float) -> float:
+        """Returns the duration in seconds which the specified percentage of recorded durations did not exceed."""
+        if not self.count:
+            return 0.0
+
+        # the rank of the duration, as in nearest-rank percentiles
+        rank = max(1, -(-self.count * percent // 100))
+
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                # the upper bound of a bucket can be further off than the longest duration
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+
+        return self.max
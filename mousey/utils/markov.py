@@ -0,0 +1,574 @@
+# -*- coding: utf-8 -*-
+import array
+import asyncio
+import bisect
+import collections
+import functools
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator, List, Optional
+
+
+# version of the format used by IncrementalText.to_bytes, models stored in a different format get built again
+STORE_VERSION = 1
+
+# ids of the tokens which mark the beginning and end of a sentence, words get the ids after them
+BEGIN = 0
+END = 1
+# sentences are encoded as strings of their word ids as characters, so overlaps can be found using str.find
+MAX_WORD_ID = sys.maxunicode
+# bits used by each word id in a state packed into a single int
+ID_BITS = MAX_WORD_ID.bit_length()
+ID_MASK = (1 << ID_BITS) - 1
+# states with at least this many followers keep their cumulative weights between sentences
+CACHED_WEIGHTS_MIN = 16
+
+# the same sentence splitting and filtering as markovify.NewlineText,
+# sentences with punctuation which would look strange on its own in a generated sentence are skipped
+SENTENCE_SPLIT_RE = re.compile(r'\s*\n\s*')
+SENTENCE_REJECT_RE = re.compile(r"(^')|('$)|\s'|'\s|[\"(\(\)\[\])]")
+
+# approximate bytes used by each part of a model, used to estimate its memory usage without walking all of it
+STATE_BYTES = 90  # a packed state, its entry in the model and what can follow it
+TRANSITION_BYTES = 16  # a follower id and its count in the array of a state
+WORD_BYTES = 50  # the entries of a word in the vocabulary, without the word string itself
+SENTENCE_BYTES = 10  # the entry of a sentence in the deque of sentences, without the sentence string itself
+
+
+class IncrementalChain:
+    """
+    Markov chain of word ids which runs can be added to and removed from after it got built.
+
+    States are packed into a single int of ID_BITS per id, what can follow each state is kept in an array of
+    follower ids and their counts after each other. Most states only have a single follower, these are kept as an int
+    of the count shifted by ID_BITS and the follower id instead. The begin state only consists of BEGIN, so it's 0.
+
+    Parameters
+    ----------
+    state_size : int
+        The number of ids the chain uses to represent its state
+
+    Attributes
+    ----------
+    model : Dict[int, Union[int, array.array]]
+        The follower ids and counts of each packed state
+    transitions : int
+        The amount of different followers of all states
+    """
+
+    def __init__(self, state_size: int):
+        self.state_size = state_size
+        self.model = {}
+        self.transitions = 0
+
+        self._mask = (1 << ID_BITS * state_size) - 1
+        self._weights = {}  # state -> followers and cumulative counts of states with a lot of followers
+
+    def _transitions(self, run: Iterable[int]):
+        state = BEGIN
+        mask = self._mask
+
+        for follow in run:
+            yield state, follow
+            state = (state << ID_BITS | follow) & mask
+
+        yield state, END
+
+    def add(self, run: Iterable[int]):
+        """Add a run of word ids."""
+        model = self.model
+        weights = self._weights
+
+        for state, follow in self._transitions(run):
+            table = model.get(state)
+            if table is None:
+                model[state] = 1 << ID_BITS | follow
+                self.transitions += 1
+                continue
+
+            if type(table) is int:
+                if table & ID_MASK == follow:
+                    model[state] = table + (1 << ID_BITS)
+                else:
+                    model[state] = array.array('I', (table & ID_MASK, table >> ID_BITS, follow, 1))
+                    self.transitions += 1
+                continue
+
+            weights.pop(state, None)
+
+            try:
+                index = table[::2].index(follow) * 2
+            except ValueError:
+                table.extend((follow, 1))
+                self.transitions += 1
+            else:
+                table[index + 1] += 1
+
+    def remove(self, run: Iterable[int]):
+        """Remove a run of word ids which has been added before."""
+        model = self.model
+        weights = self._weights
+
+        for state, follow in self._transitions(run):
+            table = model[state]
+
+            if type(table) is int:
+                if table >> ID_BITS > 1:
+                    model[state] = table - (1 << ID_BITS)
+                else:
+                    del model[state]
+                    self.transitions -= 1
+                continue
+
+            weights.pop(state, None)
+
+            index = table[::2].index(follow) * 2
+            if table[index + 1] > 1:
+                table[index + 1] -= 1
+                continue
+
+            del table[index:index + 2]
+            self.transitions -= 1
+
+            if len(table) == 2:
+                model[state] = table[1] << ID_BITS | table[0]
+
+    def move(self, state: int) -> int:
+        """Choose a follower of a state weighted by how often it followed the state."""
+        weights = self._weights.get(state)
+
+        if weights is None:
+            table = self.model[state]
+            if type(table) is int:
+                return table & ID_MASK
+
+            weights = table[::2], array.array('I', itertools.accumulate(table[1::2]))
+
+            if len(table) >= CACHED_WEIGHTS_MIN * 2:
+                self._weights[state] = weights
+
+        followers, cumulative = weights
+        return followers[bisect.bisect(cumulative, random.random() * cumulative[-1])]
+
+    def walk(self) -> List[int]:
+        """Generate a run of word ids starting from the begin state."""
+        run = []
+        state = BEGIN
+        mask = self._mask
+
+        while True:
+            follow = self.move(state)
+            if follow == END:
+                return run
+
+            run.append(follow)
+            state = (state << ID_BITS | follow) & mask
+
+
+class IncrementalText:
+    """
+    Newline separated markov model which messages can be added to after it got built.
+
+    Only the most recent sentences are kept, adding messages removes the oldest sentences from the chain again.
+    Words are interned into a vocabulary and sentences are kept as strings of word ids, which the chain is built of.
+    Generated sentences get rejected if they overlap too much with a sentence of the corpus, like in markovify.
+    The model is safe to use from multiple threads, each method holds a lock while it runs.
+
+    Parameters
+    ----------
+    state_size : int
+        The number of words the model uses to represent its state
+    max_sentences : int
+        How many sentences to keep at most
+
+    Attributes
+    ----------
+    watermark : int
+        The ID of the most recent message which was added, messages after this one still need to be added
+    created_at : float
+        The UNIX timestamp of when the model was first built
+    """
+
+    def __init__(self, *, state_size: int=2, max_sentences: int=10000):
+        self.state_size = state_size
+        self.max_sentences = max_sentences
+
+        self.chain = IncrementalChain(state_size)
+        self.watermark = 0
+        self.created_at = time.time()
+
+        self.lock = threading.Lock()
+
+        self._vocabulary = ['', '']  # id -> word, the first ids are BEGIN and END
+        self._ids = {}  # word -> id
+
+        self._sentences = collections.deque()
+        self._rejoined = ''
+        self._removed = 0  # sentences removed since the chain was last compacted
+
+        # the size of the word and sentence strings, for estimating memory usage
+        self._vocabulary_bytes = 0
+        self._sentence_bytes = 0
+
+    def __len__(self):
+        return len(self._sentences)
+
+    @property
+    def rejoined_text(self) -> str:
+        # the text gets joined again when it's needed after it changed, not every time it changes
+        if self._rejoined is None:
+            self._rejoined = chr(END).join(self._sentences)
+        return self._rejoined
+
+    @property
+    def needs_compaction(self) -> bool:
+        """Whether more sentences were removed from the chain than it contains, leaving a lot of unused memory."""
+        return self._removed > len(self._sentences)
+
+    @property
+    def memory_usage(self) -> int:
+        """The approximate amount of bytes used by the model, including the chain and rejoined text."""
+        return (
+            len(self.chain.model) * STATE_BYTES
+            + self.chain.transitions * TRANSITION_BYTES
+            + len(self._vocabulary) * WORD_BYTES
+            + len(self._sentences) * SENTENCE_BYTES
+            + self._vocabulary_bytes
+            + self._sentence_bytes * 2  # the rejoined text is about as big as the sentences
+        )
+
+    @staticmethod
+    def split(messages: Iterable[str]) -> Iterator[List[str]]:
+        """Split messages into sentences of words, skipping sentences which would look strange in generated ones."""
+        for message in messages:
+            for sentence in SENTENCE_SPLIT_RE.split(message):
+                if sentence.strip() and SENTENCE_REJECT_RE.search(sentence) is None:
+                    yield sentence.split()
+
+    def _encode(self, words: List[str]) -> Optional[str]:
+        ids = self._ids
+        vocabulary = self._vocabulary
+
+        encoded = []
+        for word in words:
+            word_id = ids.get(word)
+            if word_id is None:
+                word_id = len(vocabulary)
+                if word_id > MAX_WORD_ID:
+                    return None
+
+                ids[word] = word_id
+                vocabulary.append(word)
+                self._vocabulary_bytes += sys.getsizeof(word)
+
+            encoded.append(word_id)
+
+        return ''.join(map(chr, encoded))
+
+    def _decode(self, sentence: str) -> List[str]:
+        vocabulary = self._vocabulary
+        return [vocabulary[x] for x in map(ord, sentence)]
+
+    def _append(self, sentence: str):
+        self.chain.add(map(ord, sentence))
+        self._sentences.append(sentence)
+        self._sentence_bytes += sys.getsizeof(sentence)
+
+    def _popleft(self):
+        sentence = self._sentences.popleft()
+        self.chain.remove(map(ord, sentence))
+        self._sentence_bytes -= sys.getsizeof(sentence)
+
+    def add(self, messages: Iterable[str], watermark: int=None):
+        """
+        Add messages to the model, removing the oldest sentences if there are too many.
+
+        Parameters
+        ----------
+        messages : Iterable[str]
+            The messages to add, oldest first
+        watermark : Optional[int]
+            The ID of the most recent message
+        """
+        runs = list(self.split(messages))
+
+        with self.lock:
+            added = False
+            for words in runs[-self.max_sentences:]:
+                sentence = self._encode(words)
+                if sentence is None:
+                    continue  # the vocabulary is full, compacting drops the words of removed sentences
+
+                self._append(sentence)
+                added = True
+
+            removed = 0
+            while len(self._sentences) > self.max_sentences:
+                self._popleft()
+                removed += 1
+
+            self._removed += removed
+
+            if added or removed:
+                self._rejoined = None
+
+            if watermark is not None:
+                self.watermark = max(self.watermark, watermark)
+
+    def _rebuild(self, runs: Iterable[List[str]]):
+        self.chain = IncrementalChain(self.state_size)
+
+        self._vocabulary = ['', '']
+        self._ids = {}
+        self._sentences = collections.deque()
+        self._rejoined = None
+        self._removed = 0
+        self._vocabulary_bytes = 0
+        self._sentence_bytes = 0
+
+        for words in runs:
+            sentence = self._encode(words)
+            if sentence is not None:
+                self._append(sentence)
+
+    def compact(self):
+        """Build the chain and vocabulary again from the current sentences, to free the memory used by removed ones."""
+        with self.lock:
+            self._rebuild([self._decode(x) for x in self._sentences])
+
+    def to_bytes(self) -> bytes:
+        """Serialize the model as zlib compressed JSON, the chain is built again from the sentences when it's loaded."""
+        with self.lock:
+            data = {
+                'version': STORE_VERSION,
+                'state_size': self.state_size,
+                'max_sentences': self.max_sentences,
+                'watermark': self.watermark,
+                'created_at': self.created_at,
+                'sentences': [self._decode(x) for x in self._sentences],
+            }
+
+        return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'IncrementalText':
+        """
+        Load a model serialized using to_bytes.
+
+        Raises
+        ------
+        ValueError
+            The data is not a model or the model was stored in a different format
+        """
+        try:
+            data = json.loads(zlib.decompress(data).decode('utf-8'))
+        except (zlib.error, UnicodeDecodeError) as e:
+            raise ValueError(f'Invalid model data: {e}') from e
+
+        if not isinstance(data, dict) or data.get('version') != STORE_VERSION:
+            raise ValueError('Model was stored in a different format')
+
+        model = cls(state_size=data['state_size'], max_sentences=data['max_sentences'])
+        model._rebuild(data['sentences'])
+        model.watermark = data['watermark']
+        model.created_at = data['created_at']
+
+        return model
+
+    def test_sentence_output(self, run: List[int], max_overlap_ratio: float, max_overlap_total: int) -> bool:
+        """
+        Whether a generated run of word ids doesn't share too many words in a row with a sentence of the corpus.
+
+        The limit is the smaller one of max_overlap_ratio of the words of the run and max_overlap_total words.
+        Unlike markovify only whole words in the same sentence are matched, as the sentences are strings of word ids.
+        """
+        overlap_max = min(max_overlap_total, int(round(max_overlap_ratio * len(run))))
+        overlap_over = overlap_max + 1
+
+        encoded = ''.join(map(chr, run))
+        text = self.rejoined_text
+
+        for index in range(max(len(run) - overlap_max, 1)):
+            if encoded[index:index + overlap_over] in text:
+                return False
+        return True
+
+    def make_sentence(self, *, tries: int=10, max_overlap_ratio: float=0.7, max_overlap_total: int=15,
+                      test_output: bool=True, max_words: int=None) -> Optional[str]:
+        """
+        Generate a sentence, the same way as markovify.Text.make_sentence does.
+
+        Parameters
+        ----------
+        tries : int
+            How many sentences to generate before giving up
+        max_overlap_ratio : float
+            See test_sentence_output
+        max_overlap_total : int
+            See test_sentence_output
+        test_output : bool
+            Whether to reject sentences which overlap too much with the corpus
+        max_words : Optional[int]
+            Sentences with more words than this get rejected
+
+        Returns
+        -------
+        Optional[str]
+            The sentence, None if no sentence which wasn't rejected got generated
+        """
+        with self.lock:
+            if not self.chain.model:
+                return None  # there's nothing to make a sentence of
+
+            for _ in range(tries):
+                run = self.chain.walk()
+
+                if max_words is not None and len(run) > max_words:
+                    continue
+                if test_output and not self.test_sentence_output(run, max_overlap_ratio, max_overlap_total):
+                    continue
+
+                return ' '.join(self._vocabulary[x] for x in run)
+
+        return None
+
+
+ModelInfo = collections.namedtuple('ModelInfo', 'watermark sentences needs_compaction created_at memory_usage')
+
+
+def _info(model: IncrementalText) -> ModelInfo:
+    return ModelInfo(model.watermark, len(model), model.needs_compaction, model.created_at, model.memory_usage)
+
+
+# models kept resident in a worker process, these functions are run in the workers and look models up in here
+_resident = {}
+
+
+def _add(key: str, text: str, watermark: int, max_sentences: int, *, models: dict=None) -> ModelInfo:
+    models = _resident if models is None else models
+
+    model = models.get(key)
+    if model is None:
+        model = models[key] = IncrementalText(max_sentences=max_sentences)
+
+    model.add([text], watermark)
+    return _info(model)
+
+
+def _load(key: str, data: bytes, *, models: dict=None) -> ModelInfo:
+    models = _resident if models is None else models
+
+    model = models[key] = IncrementalText.from_bytes(data)
+    return _info(model)
+
+
+def _dump(key: str, *, models: dict=None) -> Optional[bytes]:
+    model = (_resident if models is None else models).get(key)
+    return model.to_bytes() if model is not None else None
+
+
+def _compact(key: str, *, models: dict=None) -> Optional[ModelInfo]:
+    model = (_resident if models is None else models).get(key)
+    if model is None:
+        return None
+
+    model.compact()
+    return _info(model)
+
+
+def _make_sentence(key: str, kwargs: dict, *, models: dict=None) -> Optional[str]:
+    model = (_resident if models is None else models).get(key)
+    return model.make_sentence(**kwargs) if model is not None else None
+
+
+def _drop(key: str, *, models: dict=None):
+    (_resident if models is None else models).pop(key, None)
+
+
+class ModelPool:
+    """
+    Keeps markov models and runs anything that uses them outside of the event loop.
+
+    Without workers the models are kept in this process and used in the default executor. Building models is
+    pure python, which holds the GIL and can still stall the event loop. With workers each model is kept resident
+    in one worker process, chosen by its key, so only new messages and generated sentences are sent between processes.
+
+    Parameters
+    ----------
+    loop : asyncio.AbstractEventLoop
+        The event loop to run the executors of
+    workers : int
+        The amount of worker processes to use, 0 to use threads of this process
+    max_sentences : int
+        How many sentences models keep at most
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, workers: int=0, max_sentences: int=10000):
+        self.loop = loop
+        self.max_sentences = max_sentences
+
+        self._models = {}  # only used without workers
+        self._keys = {}  # key -> index of the worker the model is resident in
+        self._workers = [ProcessPoolExecutor(max_workers=1) for _ in range(workers)]
+
+    def __contains__(self, key: str):
+        return key in self._keys
+
+    def _worker(self, key: str) -> int:
+        return zlib.crc32(key.encode('utf-8')) % len(self._workers) if self._workers else 0
+
+    async def _run(self, key: str, func, *args):
+        if not self._workers:
+            return await self.loop.run_in_executor(None, functools.partial(func, key, *args, models=self._models))
+
+        index = self._worker(key)
+        try:
+            return await self.loop.run_in_executor(self._workers[index], func, key, *args)
+        except BrokenProcessPool:
+            # the worker died, every model which was resident in it is lost
+            self._workers[index] = ProcessPoolExecutor(max_workers=1)
+            self._keys = {x: y for x, y in self._keys.items() if y != index}
+            raise
+
+    async def add(self, key: str, messages: List[str], watermark: int) -> ModelInfo:
+        """Add messages to a model, creating it if it doesn't exist."""
+        # a single string is a lot cheaper to send to a worker than a list of strings
+        info = await self._run(key, _add, '\n'.join(messages), watermark, self.max_sentences)
+        self._keys[key] = self._worker(key)
+        return info
+
+    async def load(self, key: str, data: bytes) -> ModelInfo:
+        """Load a model serialized using IncrementalText.to_bytes, raises ValueError if the data is invalid."""
+        info = await self._run(key, _load, data)
+        self._keys[key] = self._worker(key)
+        return info
+
+    async def dump(self, key: str) -> Optional[bytes]:
+        """Serialize a model using IncrementalText.to_bytes, returns None if the model does not exist."""
+        return await self._run(key, _dump)
+
+    async def compact(self, key: str) -> Optional[ModelInfo]:
+        """Compact a model, returns None if the model does not exist."""
+        return await self._run(key, _compact)
+
+    async def make_sentence(self, key: str, **kwargs) -> Optional[str]:
+        """Generate a sentence using a model, returns None if it fails or if the model does not exist."""
+        return await self._run(key, _make_sentence, kwargs)
+
+    async def drop(self, key: str):
+        """Delete a model."""
+        if self._keys.pop(key, None) is not None:
+            await self._run(key, _drop)
+
+    def close(self):
+        """Shut down the worker processes, models which haven't been dumped are lost."""
+        for worker in self._workers:
+            worker.shutdown(wait=False)
@@ -15,57 +15,130 @@ WEEK = DAY * 7
 MONTH = DAY * 30
 YEAR = DAY * 365
 
-TIME_RE = re.compile(
-    r"^(me )?(in )?"
-    r"(?:(?P<months>\d+)( ?months?| ?mo))? ?"
-    r"(?:(?P<weeks>\d+)( ?weeks?| ?w))? ?"
-    r"(?:(?P<days>\d+)( ?days?|d))? ?"
-    r"(?:(?P<hours>\d+)( ?hours?| ?hrs?| ?h))? ?"
-    r"(?:(?P<minutes>\d+)( ?minutes?| ?mins?| ?m))? ?"
-    r"((?P<seconds>\d+)( ?seconds?| ?secs?| ?s))? ?"
-    r"(about |to )?"
-    r"(?P<rest>.*)",
-    re.IGNORECASE
+# maximum amount of time which can be converted, datetimes can't be much further in the future
+MAX_SECONDS = YEAR * 100
+
+# units in the order in which they can be used, each unit can only follow bigger units
+UNITS = (
+    (MONTH, ('months', 'month', 'mo')),
+    (WEEK, ('weeks', 'week', 'w')),
+    (DAY, ('days', 'day', 'd')),
+    (HOUR, ('hours', 'hour', 'hrs', 'hr', 'h')),
+    (MINUTE, ('minutes', 'minute', 'mins', 'min', 'm')),
+    (SECOND, ('seconds', 'second', 'secs', 'sec', 's')),
 )
+UNIT_NAMES = {name: (index, seconds) for index, (seconds, names) in enumerate(UNITS) for name in names}
 
+# none of these patterns can backtrack more than a constant amount, matching them is linear
+DIGITS_RE = re.compile(r'\d+')
+LETTERS_RE = re.compile(r'[a-z]+', re.IGNORECASE)
+SPACE_RE = re.compile(r'\s*')
+DATE_RE = re.compile(r'(?:on )?(\d{4})-(\d{1,2})-(\d{1,2})(?=\s|$)', re.IGNORECASE)
+CLOCK_RE = re.compile(r'(?:at )?(\d{1,2}):(\d{2})(?::(\d{2}))?(?=\s|$)', re.IGNORECASE)
 
-def _from_human_time(argument: str) -> Tuple[int, commands.RecalledArgument]:
+
+def _skip_word(argument: str, position: int, *words: str) -> int:
+    """Skips one of the words and a following space at the position, ignoring case."""
+    for word in words:
+        end = position + len(word) + 1
+        if argument[position:end].lower() == f'{word} ':
+            return end
+    return position
+
+
+def _parse_duration(argument: str, position: int) -> Tuple[int, int]:
+    """Parses durations like 1 day 5h 3 minutes at the position. Returns the seconds and where the duration ends."""
+    total_seconds = 0
+    next_unit = 0
+
+    while True:
+        number = DIGITS_RE.match(argument, position)
+        if number is None:
+            break
+
+        # there may be one space between the number and the unit
+        unit_start = number.end()
+        if argument[unit_start:unit_start + 1] == ' ':
+            unit_start += 1
+
+        unit = LETTERS_RE.match(argument, unit_start)
+        if unit is None:
+            break
+
+        index, seconds = UNIT_NAMES.get(unit.group().lower(), (-1, 0))
+        if index < next_unit:
+            break  # not a unit or a unit which should have been used earlier
+
+        digits = number.group()
+        if len(digits) > 12:
+            raise commands.BadArgument("That time is too far in the future.")
+
+        total_seconds += int(digits) * seconds
+        next_unit = index + 1
+
+        position = SPACE_RE.match(argument, unit.end()).end()
+
+    return total_seconds, position
+
+
+def _parse_date(argument: str, position: int, now: datetime.datetime) -> Tuple[int, int]:
     """
-    Convert an string argument into a number of seconds and the remaining text.
+    Parses an absolute date and/or time in UTC at the position. Returns the seconds until then and where it ends.
 
-    Times below 0 seconds are not supported, if no time is found 0 seconds is returned.
+    Times without a date refer to the next time it is this time of the day.
     """
-    match = TIME_RE.search(argument)
-    total_seconds = 0
+    date = DATE_RE.match(argument, position)
+    if date is not None:
+        position = SPACE_RE.match(argument, date.end()).end()
+
+    clock = CLOCK_RE.match(argument, position)
+    if clock is not None:
+        position = SPACE_RE.match(argument, clock.end()).end()
+
+    if date is None and clock is None:
+        return 0, position
+
+    try:
+        hour, minute, second = (int(x or 0) for x in clock.groups()) if clock is not None else (0, 0, 0)
+
+        if date is not None:
+            year, month, day = (int(x) for x in date.groups())
+            target = datetime.datetime(year, month, day, hour, minute, second)
+        else:
+            target = now.replace(hour=hour, minute=minute, second=second, microsecond=0)
+            if target <= now:
+                target += datetime.timedelta(days=1)
+    except ValueError:
+        raise commands.BadArgument('Invalid date or time.')
 
-    months = match.group("months")
-    if months:
-        total_seconds += int(months) * MONTH
+    return int((target - now).total_seconds()), position
 
-    weeks = match.group("weeks")
-    if weeks:
-        total_seconds += int(weeks) * WEEK
 
-    days = match.group("days")
-    if days:
-        total_seconds += int(days) * DAY
+def _from_human_time(argument: str) -> Tuple[int, commands.RecalledArgument]:
+    """
+    Convert an string argument into a number of seconds and the remaining text.
 
-    hours = match.group("hours")
-    if hours:
-        total_seconds += int(hours) * HOUR
+    Durations (in 1 day 5 hours) and absolute dates or times in UTC (on 2017-09-01 15:30, at 15:30) are supported.
+    Times below 0 seconds are not supported, if no time is found 0 seconds is returned.
 
-    minutes = match.group("minutes")
-    if minutes:
-        total_seconds += int(minutes) * MINUTE
+    The argument is read from the start once, without backtracking, which keeps this linear for any argument.
+    """
+    position = _skip_word(argument, 0, 'me')
+    position = _skip_word(argument, position, 'in')
 
-    seconds = match.group("seconds")
-    if seconds:
-        total_seconds += int(seconds) * SECOND
+    total_seconds, end = _parse_date(argument, position, datetime.datetime.utcnow())
+    if end == position:
+        total_seconds, end = _parse_duration(argument, position)
 
     if total_seconds < 0:
         raise commands.BadArgument("Could not determine amount of time.")
 
-    rest = match.group("rest")
+    if total_seconds > MAX_SECONDS:
+        raise commands.BadArgument("That time is too far in the future.")
+
+    end = _skip_word(argument, end, 'about', 'to')
+
+    rest = argument[end:]
     return total_seconds, commands.RecalledArgument(rest)
 
 
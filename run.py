@@ -8,6 +8,7 @@ import uvloop
 
 from config import POSTGRES_CRED, REDIS_CRED, TOKEN
 from mousey import Mousey
+from mousey.utils import init_connection
 
 
 logger = logging.getLogger()
@@ -20,7 +21,7 @@ asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 
 async def run():
-    db = await asyncpg.create_pool(**POSTGRES_CRED)
+    db = await asyncpg.create_pool(**POSTGRES_CRED, init=init_connection)
     redis = await aioredis.create_pool(REDIS_CRED)
 
     mousey = Mousey(db=db, redis=redis)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Config invalidations over redis pub/sub, these need a redis server on localhost:6379 and are skipped otherwise."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+aioredis = pytest.importorskip('aioredis')
+
+from mousey.ext.core import config  # noqa: E402
+
+
+REDIS_ADDRESS = ('localhost', 6379)
+
+
+async def wait_for(predicate, timeout: float=2):
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return True
+        await asyncio.sleep(0.01)
+    return predicate()
+
+
+async def never_ready():
+    await asyncio.Event().wait()
+
+
+async def run_invalidations(loop: asyncio.AbstractEventLoop):
+    try:
+        pool = await aioredis.create_pool(REDIS_ADDRESS, loop=loop)
+        publisher = await aioredis.create_redis(REDIS_ADDRESS, loop=loop)
+    except OSError:
+        pytest.skip('no redis server running on localhost')
+
+    mousey = SimpleNamespace(
+        loop=loop, db=None, redis=pool, process=None, session=None, guilds=[],
+        mention_prefixes=('<@1> ', '<@!1> '), wait_until_ready=never_ready, is_closed=lambda: False
+    )
+    cog = config.Config(mousey)
+
+    try:
+        # the listener is subscribed once a publish reaches a subscriber
+        for _ in range(200):
+            if await publisher.publish(config.INVALIDATION_CHANNEL, 'test:0'):
+                break
+            await asyncio.sleep(0.01)
+        else:
+            pytest.fail('the config listener did not subscribe')
+
+        for guild_id in (1, 2):
+            cog.configs[guild_id] = guild_config = config.GuildConfig({'prefixes': ['!']})
+            cog._update_prefixes(guild_id, guild_config)
+
+        # invalidations published by the process itself are ignored, other ones drop the config
+        await publisher.publish(config.INVALIDATION_CHANNEL, f'{cog.process_id}:2')
+        await publisher.publish(config.INVALIDATION_CHANNEL, 'test:1')
+
+        assert await wait_for(lambda: 1 not in cog.configs)
+        assert 1 not in cog.prefixes
+        assert 2 in cog.configs and 2 in cog.prefixes
+
+        await publisher.publish(config.INVALIDATION_CHANNEL, 'test:*')
+        assert await wait_for(lambda: not cog.configs)
+        assert not cog.prefixes
+    finally:
+        cog._listener.cancel()
+        for task in cog._scheduled_tasks:
+            task.cancel()
+
+        publisher.close()
+        pool.close()
+        await pool.wait_closed()
+
+
+def test_published_invalidations():
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run_invalidations(loop))
+    finally:
+        loop.close()
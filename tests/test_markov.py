@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from types import SimpleNamespace
+
+from mousey.ext import markov
+
+
+class FakeRedis:
+    """Stands in for the aioredis pool, which returns bytes as run.py creates it without an encoding."""
+
+    def __init__(self, values: dict):
+        self.values = values
+
+    def __await__(self):
+        return self
+        yield  # makes this a generator, `with await pool as conn` returns the pool itself
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    async def mget(self, *keys):
+        return [self.values.get(x) for x in keys]
+
+
+def public_channels(values: dict, channels: list) -> list:
+    cog = markov.Markov.__new__(markov.Markov)
+    cog.redis = FakeRedis(values)
+
+    guild = SimpleNamespace(member_count=100)
+    return asyncio.get_event_loop().run_until_complete(cog.public_channels(guild, channels))
+
+
+def test_public_channels_all_cached(monkeypatch):
+    def readers(guild, channels):
+        raise AssertionError('cached channels must not be computed again')
+
+    monkeypatch.setattr(markov, '_readers', readers)
+
+    channels = [SimpleNamespace(id=1), SimpleNamespace(id=2), SimpleNamespace(id=3)]
+    values = {
+        'mousey:markov_channels:1': b'1',
+        'mousey:markov_channels:2': b'0',
+        'mousey:markov_channels:3': b'0',
+    }
+
+    assert public_channels(values, channels) == [1]
+
+
+def test_public_channels_none_public(monkeypatch):
+    monkeypatch.setattr(markov, '_readers', None)
+
+    channels = [SimpleNamespace(id=1), SimpleNamespace(id=2)]
+    values = {'mousey:markov_channels:1': b'0', 'mousey:markov_channels:2': b'0'}
+
+    assert public_channels(values, channels) == []